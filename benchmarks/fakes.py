@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+from utils.sessionTracker import SessionTracker
+from utils.statsRepository import StatsRepository
+from utils.trackedChannels import TrackedChannels
+
+
+class FakeGuild:
+    """
+    Stands in for a discord.Guild whose member cache is complete, as after chunking at startup.
+    """
+    __slots__ = ("id", "members", "chunked")
+
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.members = {}  # Member ID -> FakeMember
+        self.chunked = True
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return None
+
+
+class FakeChannel:
+    """
+    Stands in for a discord.VoiceChannel. Only the attributes the voice listener reads are provided.
+    """
+    __slots__ = ("id", "guild", "voice_states")
+
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.voice_states = {}  # Member ID -> FakeVoiceState, like the real channel's
+
+
+class FakeMember:
+    __slots__ = ("id", "guild", "display_name")
+
+    def __init__(self, member_id, guild):
+        self.id = member_id
+        self.guild = guild
+        self.display_name = f"member-{member_id}"
+
+
+class FakeRole:
+    __slots__ = ("id", "guild", "name", "members")
+
+    def __init__(self, role_id, guild, members):
+        self.id = role_id
+        self.guild = guild
+        self.name = f"role-{role_id}"
+        self.members = members
+
+    def __str__(self):
+        return self.name
+
+
+class FakeContext:
+    """
+    Stands in for a slash command's ApplicationContext. Replies are serialised the way the HTTP layer would send
+    them, and the moment the first one is ready is kept in first_response (a perf_counter time).
+    """
+
+    def __init__(self, guild, author):
+        self.guild = guild
+        self.author = author
+        self.first_response = None
+        self.responses = []
+
+    async def defer(self):
+        pass
+
+    async def respond(self, content=None, *, embed=None, embeds=None, file=None, files=None):
+        payload = [item.to_dict() for item in ([embed] if embed is not None else embeds or [])]
+        self.responses.append((content, payload))
+        if self.first_response is None:
+            self.first_response = time.perf_counter()
+
+    @property
+    def followup(self):
+        return self
+
+    async def send(self, content=None, **kwargs):
+        await self.respond(content, **kwargs)
+
+
+class FakeVoiceState:
+    __slots__ = ("channel",)
+
+    def __init__(self, channel=None):
+        self.channel = channel
+
+
+class FakeBot:
+    """
+    The parts of the bot a cog touches: the database, tracked channels, open sessions, the event loop, channel
+    lookups and event dispatch. wait_until_ready never returns, so background task loops started by cogs stay idle
+    during a benchmark.
+    """
+
+    def __init__(self, db, channels):
+        self.db = db
+        self.stats = StatsRepository(db)
+        self.tracked = TrackedChannels(db)
+        self.sessions = SessionTracker()
+        self.loop = asyncio.get_running_loop()
+        self.channels = {channel.id: channel for channel in channels}
+        self.dispatched = {}
+        self._ready = asyncio.Event()
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def track(self, channels):
+        await self.tracked.load()
+        for channel in channels:
+            await self.tracked.add(channel.guild.id, channel.id)
+
+    def dispatch(self, event, *args, **kwargs):
+        self.dispatched[event] = self.dispatched.get(event, 0) + 1
+
+    async def wait_until_ready(self):
+        await self._ready.wait()
+
+
+class VoiceWorld:
+    """
+    Tracks where every fake member is sitting and builds the (member, before, after) arguments of
+    on_voice_state_update for each move.
+    """
+
+    def __init__(self, guild, channels):
+        self.guild = guild
+        self.channels = channels
+        self.members = {}
+        self.located = {}  # Member ID -> FakeChannel
+
+    def member(self, member_id):
+        member = self.members.get(member_id)
+        if member is None:
+            member = self.members[member_id] = FakeMember(member_id, self.guild)
+        return member
+
+    def move(self, member_id, channel):
+        """
+        Moves a member to channel (None to disconnect) and returns the event arguments.
+        """
+        member = self.member(member_id)
+        previous = self.located.pop(member_id, None)
+        if previous is not None:
+            del previous.voice_states[member_id]
+        after = FakeVoiceState(channel)
+        if channel is not None:
+            channel.voice_states[member_id] = after
+            self.located[member_id] = channel
+        return member, FakeVoiceState(previous), after
@@ -0,0 +1,159 @@
+"""
+Compares the startup cost of the full and lean gateway settings (see utils/gateway.py) for one large guild.
+
+Each mode gets a real discord.py ConnectionState that is fed a synthetic GUILD_CREATE payload and, in full mode,
+the member chunks (with presences) that chunking at startup would receive. The time to process them and the memory
+the state holds afterwards are reported. No Discord connection is made.
+
+Run from the repository root:
+
+    python -m benchmarks.gatewayBench --members 50000
+"""
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from discord.state import ChunkRequest, ConnectionState
+from utils.gateway import gateway_options
+from utils.utils import resident_memory
+
+GUILD_ID = 1000
+ROLE_IDS = [2000 + i for i in range(40)]
+VOICE_CHANNEL_IDS = [3000 + i for i in range(8)]
+CHUNK_SIZE = 1000  # Members per GUILD_MEMBERS_CHUNK, as Discord sends them
+
+
+def member_payload(user_id, rng):
+    return {
+        "user": {"id": str(user_id), "username": f"member{user_id}", "discriminator": f"{user_id % 10000:04d}",
+                 "avatar": None},
+        "roles": [str(role_id) for role_id in rng.sample(ROLE_IDS, rng.randint(0, 4))],
+        "joined_at": "2022-01-01T00:00:00+00:00",
+        "nick": None,
+        "deaf": False,
+        "mute": False,
+    }
+
+
+def presence_payload(user_id, rng):
+    return {
+        "user": {"id": str(user_id)},
+        "status": rng.choice(["online", "idle", "dnd"]),
+        "activities": [{"name": "Squad", "type": 0, "created_at": 0}],
+        "client_status": {"desktop": "online"},
+    }
+
+
+def guild_payload(members, in_voice, presences, rng):
+    voice_ids = range(1, in_voice + 1)
+    return {
+        "id": str(GUILD_ID),
+        "name": "Benchmark",
+        "owner_id": "1",
+        "member_count": members,
+        "large": True,
+        "roles": [{"id": str(role_id), "name": f"role{role_id}", "permissions": "0", "position": index, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}
+                  for index, role_id in enumerate([GUILD_ID, *ROLE_IDS])],
+        "channels": [{"id": str(channel_id), "type": 2, "name": f"voice{channel_id}", "position": index,
+                      "permission_overwrites": [], "bitrate": 64000, "user_limit": 0}
+                     for index, channel_id in enumerate(VOICE_CHANNEL_IDS)],
+        # Large guilds only include members in voice (and the bot) in GUILD_CREATE
+        "members": [member_payload(user_id, rng) for user_id in voice_ids],
+        "voice_states": [{"user_id": str(user_id), "channel_id": str(rng.choice(VOICE_CHANNEL_IDS)),
+                          "session_id": "x", "deaf": False, "mute": False, "self_deaf": False, "self_mute": False,
+                          "self_video": False, "suppress": False} for user_id in voice_ids],
+        "presences": [presence_payload(user_id, rng) for user_id in voice_ids] if presences else [],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "threads": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+    }
+
+
+def chunk_payloads(members, presences, nonce, rng):
+    chunk_count = -(-members // CHUNK_SIZE)
+    for index in range(chunk_count):
+        ids = range(index * CHUNK_SIZE + 1, min(members, (index + 1) * CHUNK_SIZE) + 1)
+        yield {
+            "guild_id": str(GUILD_ID),
+            "members": [member_payload(user_id, rng) for user_id in ids],
+            "presences": [presence_payload(user_id, rng) for user_id in ids] if presences else [],
+            "chunk_index": index,
+            "chunk_count": chunk_count,
+            "nonce": nonce,
+        }
+
+
+async def start_guild(lean, members, in_voice, seed):
+    """
+    Builds a ConnectionState with the given mode's settings and feeds it one guild's startup traffic. Returns the
+    state, the seconds spent processing and the number of members left in the cache. Lean mode caches none: members
+    in voice at startup are only kept once a voice state update of theirs arrives.
+    """
+    options = gateway_options(lean)
+    state = ConnectionState(dispatch=lambda *args: None, handlers={}, hooks={}, http=None,
+                            loop=asyncio.get_running_loop(), **options)
+    presences = options["intents"].presences
+    chunk = options.get("chunk_guilds_at_startup", True)
+    rng = random.Random(seed)
+
+    elapsed = 0.0
+    payload = guild_payload(members, in_voice, presences, rng)
+    start = time.perf_counter()
+    guild = state._add_guild_from_data(payload)
+    elapsed += time.perf_counter() - start
+
+    if chunk:
+        request = ChunkRequest(GUILD_ID, state.loop, state._get_guild, cache=state.member_cache_flags.joined)
+        state._chunk_requests[request.nonce] = request
+        for data in chunk_payloads(members, presences, request.nonce, rng):
+            start = time.perf_counter()
+            state.parse_guild_members_chunk(data)
+            elapsed += time.perf_counter() - start
+        request.buffer.clear()
+
+    return state, elapsed, len(guild.members)
+
+
+async def measure(lean, members, in_voice, seed):
+    gc.collect()
+    tracemalloc.start()
+    state, elapsed, cached = await start_guild(lean, members, in_voice, seed)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    return {"seconds": elapsed, "held_mb": held / 2 ** 20, "cached_members": cached}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full versus lean gateway startup cost for one large guild.")
+    parser.add_argument("--members", type=int, default=50000)
+    parser.add_argument("--in-voice", type=int, default=200, help="Members sitting in voice at startup")
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+
+    before = resident_memory()
+    results = {}
+    for name, lean in (("full", False), ("lean", True)):
+        results[name] = asyncio.run(measure(lean, options.members, options.in_voice, options.seed))
+
+    print(f"{options.members} members, {options.in_voice} in voice")
+    for name, result in results.items():
+        print(f"  {name}: {result['seconds']:.2f}s processing, {result['held_mb']:.1f} MB held, "
+              f"{result['cached_members']} members cached at startup")
+    full, lean = results["full"], results["lean"]
+    print(f"  lean uses {lean['seconds'] / full['seconds']:.1%} of the time and "
+          f"{lean['held_mb'] / full['held_mb']:.1%} of the memory")
+    if before is not None:
+        print(f"  process RSS {before:.0f} MB before, {resident_memory():.0f} MB after")
+
+
+if __name__ == "__main__":
+    main()
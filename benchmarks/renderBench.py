@@ -0,0 +1,192 @@
+"""
+Measures how the stats commands scale with the size of a role and the number of channels members are tracked in.
+Each command body runs against a seeded temporary database and stand-in guild, role and members, so no gateway
+connection or bot token is needed.
+
+For every data size each command is reported with its time to first response (until the reply's embeds are
+serialised, as they would be for the HTTP request) and the peak memory it allocated while running. Leaderboards are
+built cold, with their page cache cleared, and stop where the paginator would send its first page.
+
+Run from the repository root:
+
+    python -m benchmarks.renderBench                          # 500x8, 2000x24 and 5000x48 (members x channels)
+    python -m benchmarks.renderBench --sizes 10000x64 --repeats 3
+"""
+import argparse
+import asyncio
+import datetime as dt
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeBot, FakeChannel, FakeContext, FakeGuild, FakeMember, FakeRole
+from cogs.companyStats import CompanyStats
+from cogs.viewStats import ViewStats
+from config import GUILD_ID
+from utils.database import Database
+from utils.leaderboard import LazyPaginator
+from utils.liveTime import LiveTime
+from utils.utils import utc_now, week_start
+from utils.writeBuffer import VoiceBuffer
+
+ROLE_ID = 2000
+FIRST_CHANNEL = 3000
+SUBJECT_WEEKS = 8  # Weeks of history for the member the per-member commands look at
+HISTORY_DAYS = 80  # Other members' sessions are spread over this many days, a little over the months kept
+
+
+def parse_size(text):
+    members, channels = text.lower().split("x")
+    return int(members), int(channels)
+
+
+def seed_sessions(members, channel_ids, sessions_each, rng):
+    """
+    Yields (user ID, channel ID, started at, ended at) for a guild's history. Member 1 is the subject of the
+    per-member commands and sits in every channel every week. Everyone else has sessions_each sessions at random
+    over the last HISTORY_DAYS, plus one in the current week so the weekly board is full too.
+    """
+    now = utc_now().timestamp()
+    monday = dt.datetime.combine(week_start(utc_now().date()), dt.time(), dt.timezone.utc).timestamp()
+    for weeks in range(SUBJECT_WEEKS):
+        for channel_id in channel_ids:
+            started_at = now - weeks * 7 * 86400 - rng.uniform(3600, 6 * 86400)
+            yield 1, channel_id, started_at, started_at + rng.uniform(60, 3600)
+
+    for user_id in range(2, members + 1):
+        for _ in range(sessions_each):
+            started_at = now - rng.uniform(3600, HISTORY_DAYS * 86400)
+            yield user_id, rng.choice(channel_ids), started_at, started_at + rng.uniform(60, 3 * 3600)
+        started_at = rng.uniform(monday, now - 1)
+        yield user_id, rng.choice(channel_ids), started_at, started_at + rng.uniform(0, now - started_at)
+
+
+async def seed(db, members, channel_ids, sessions_each, seed_value):
+    """
+    Writes the history through the voice buffer, so every rollup is filled the way the bot fills it. Returns the
+    number of sessions written.
+    """
+    buffer = VoiceBuffer(db, threshold=0)
+    written = 0
+    for user_id, channel_id, started_at, ended_at in seed_sessions(members, channel_ids, sessions_each,
+                                                                   random.Random(seed_value)):
+        buffer.add(GUILD_ID, user_id, channel_id, started_at, ended_at)
+        if buffer.depth >= 20000:
+            written += await buffer.flush()
+    written += await buffer.flush()
+    return written
+
+
+def commands_for(view, company, guild, role, subject):
+    """
+    Returns {name: coroutine function} running each command body with a fresh context. Each returns the context.
+    """
+    async def member_command(command, **options):
+        ctx = FakeContext(guild, subject)
+        await command.callback(view, ctx, subject, **options)
+        return ctx
+
+    async def rank():
+        ctx = FakeContext(guild, subject)
+        await view.rank.callback(view, ctx, window="monthly", member=subject, channel=None)
+        return ctx
+
+    async def leaderboard(build):
+        # Everything LazyPaginator.respond does before it calls Discord
+        ctx = FakeContext(guild, subject)
+        company.cache.clear()
+        source = await build(role)
+        paginator = LazyPaginator(source)
+        await source.load(paginator.current_page)
+        paginator.update_buttons()
+        page = paginator.get_page_content(source[paginator.current_page])
+        await ctx.respond(embeds=page.embeds)
+        return ctx
+
+    return {
+        "/alltimestats": lambda: member_command(view.alltimestats, chart=False),
+        "/weeklystats": lambda: member_command(view.weeklystats, chart=False),
+        "/monthlystats": lambda: member_command(view.monthlystats, chart=False),
+        "/rank monthly": rank,
+        "/unitstats alltime": lambda: leaderboard(company.allstats),
+        "/unitstats weekly": lambda: leaderboard(company.weeklystats),
+        "/unitstats monthly": lambda: leaderboard(company.monthlystats),
+    }
+
+
+async def first_response(run):
+    start = time.perf_counter()
+    ctx = await run()
+    return ctx.first_response - start
+
+
+async def peak_memory(run):
+    # A separate run, tracing would inflate the timings
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    try:
+        await run()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+async def measure(directory, members, channels, options):
+    db = Database(os.path.join(directory, f"render{members}x{channels}.db"))
+    await db.open()
+    guild = FakeGuild(GUILD_ID)
+    channel_list = [FakeChannel(FIRST_CHANNEL + index, guild) for index in range(channels)]
+    bot = FakeBot(db, channel_list)
+    await bot.track(channel_list)
+
+    start = time.perf_counter()
+    sessions = await seed(db, members, [channel.id for channel in channel_list], options.sessions, options.seed)
+    seeded = time.perf_counter() - start
+
+    for user_id in range(1, members + 1):
+        guild.members[user_id] = FakeMember(user_id, guild)
+    role = FakeRole(ROLE_ID, guild, list(guild.members.values()))
+
+    # Members in voice right now, their time is merged into every read
+    rng = random.Random(options.seed)
+    for user_id in rng.sample(range(1, members + 1), min(options.in_voice, members)):
+        bot.sessions.start(GUILD_ID, user_id, rng.choice(channel_list).id, bot.sessions.clock() - 3600)
+    bot.stats.live = LiveTime(bot.sessions, VoiceBuffer(db, threshold=0))
+
+    view, company = ViewStats(bot), CompanyStats(bot)
+    results = {}
+    for name, run in commands_for(view, company, guild, role, guild.members[1]).items():
+        await run()  # Warms the statement cache and imports
+        timings = [await first_response(run) for _ in range(options.repeats)]
+        results[name] = (statistics.median(timings), await peak_memory(run))
+    await db.close()
+    return sessions, seeded, results
+
+
+async def run(options):
+    with tempfile.TemporaryDirectory() as directory:
+        for members, channels in options.sizes:
+            sessions, seeded, results = await measure(directory, members, channels, options)
+            print(f"{members} members, {channels} channels, {sessions} sessions seeded in {seeded:.1f}s")
+            for name, (seconds, peak) in results.items():
+                print(f"  {name:<20} {seconds * 1000:8.2f} ms first response  {peak / 1024:9.1f} KiB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stats command latency and memory at increasing data sizes.")
+    parser.add_argument("--sizes", type=lambda text: [parse_size(size) for size in text.split(",")],
+                        default=[(500, 8), (2000, 24), (5000, 48)],
+                        help="Comma separated MEMBERSxCHANNELS data sizes, e.g. 500x8,5000x48")
+    parser.add_argument("--sessions", type=int, default=6, help="Sessions in each member's history")
+    parser.add_argument("--in-voice", type=int, default=50, help="Members in voice while the commands run")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per command, the median is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+    asyncio.run(run(options))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Offline benchmarks for voice ingest and the monthly rollover, run against a temporary database with stand-in
+Discord objects, so no gateway connection or bot token is needed.
+
+Run from the repository root:
+
+    python -m benchmarks.voiceBench            # run and compare against benchmarks/baseline.json
+    python -m benchmarks.voiceBench --save     # run and overwrite the baseline
+    python -m benchmarks.voiceBench --quick    # smaller workloads, for a fast sanity check
+"""
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeBot, FakeChannel, FakeGuild, VoiceWorld
+from cogs import voiceListener
+from cogs.voiceListener import VoiceListener
+from config import GUILD_ID, TRACK_CHANNEL
+from utils.database import Database
+from utils.rollover import MONTHS_KEPT, run_rollovers
+from utils.utils import recent_months
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# For each reported metric, whether a larger value is better
+HIGHER_IS_BETTER = {"events_per_sec": True, "p50_ms": False, "p99_ms": False, "wall_s": False}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def open_database(directory, name):
+    db = Database(os.path.join(directory, name))
+    await db.open()
+    return db
+
+
+# Event streams. Each yields (member ID, channel or None) moves, with None marking a point where the gateway
+# would go quiet for a moment and let other tasks (such as an early flush) run.
+
+def steady_stream(members, tracked, untracked, seed):
+    """
+    Every member joins a tracked channel, hops between channels (sometimes out of tracking and back) and leaves,
+    with all members' moves interleaved at random.
+    """
+    rng = random.Random(seed)
+    channels = tracked + [untracked]
+    moves = {member_id: rng.randint(1, 3) for member_id in range(1, members + 1)}
+    active = list(moves)
+    events = 0
+    while active:
+        index = rng.randrange(len(active))
+        member_id = active[index]
+        if moves[member_id]:
+            moves[member_id] -= 1
+            yield member_id, rng.choice(channels)
+        else:
+            active[index] = active[-1]
+            active.pop()
+            yield member_id, None
+        events += 1
+        if events % 50 == 0:
+            yield None
+
+
+def storm_stream(members, tracked, bursts, seed):
+    """
+    Bursts of members joining at once, as when an event starts, then all leaving at once when it ends. Nothing
+    else gets to run in the middle of a burst.
+    """
+    rng = random.Random(seed)
+    ids = list(range(1, members + 1))
+    for _ in range(bursts):
+        rng.shuffle(ids)
+        for member_id in ids:
+            yield member_id, rng.choice(tracked)
+        yield None
+        rng.shuffle(ids)
+        for member_id in ids:
+            yield member_id, None
+        yield None
+
+
+def flap_stream(members, tracked, drops, seed):
+    """
+    Members on unstable connections: each joins, drops out and reconnects a few times in quick succession (now and
+    then to a different channel, as a quick hop through an untracked one looks), then leaves for good.
+    """
+    rng = random.Random(seed)
+    ids = list(range(1, members + 1))
+    seats = {member_id: rng.choice(tracked) for member_id in ids}
+    for member_id in ids:
+        yield member_id, seats[member_id]
+    yield None
+    for _ in range(drops):
+        rng.shuffle(ids)
+        for member_id in ids:
+            yield member_id, None
+            if rng.random() < 0.2:
+                seats[member_id] = rng.choice(tracked)
+            yield member_id, seats[member_id]
+        yield None
+    for member_id in ids:
+        yield member_id, None
+    yield None
+
+
+async def replay(directory, name, stream, guild, tracked, channels):
+    db = await open_database(directory, name)
+    bot = FakeBot(db, channels)
+    await bot.track(tracked)
+    world = VoiceWorld(guild, channels)
+    cog = VoiceListener(bot)
+
+    latencies = []
+    start = time.perf_counter()
+    for move in stream:
+        if move is None:
+            await asyncio.sleep(0)
+            continue
+        member, before, after = world.move(*move)
+        if before.channel is after.channel:
+            continue
+        began = time.perf_counter()
+        await cog.on_voice_state_update(member, before, after)
+        latencies.append(time.perf_counter() - began)
+    await cog.shutdown()
+    wall = time.perf_counter() - start
+
+    buffer = cog.buffer
+    async with db.read() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM VoiceSessions") as cursor:
+            sessions = (await cursor.fetchone())[0]
+    await db.close()
+    return {
+        "events": len(latencies),
+        "events_per_sec": round(len(latencies) / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "wall_s": round(wall, 3),
+        "sessions": sessions,
+        "flushes": buffer.flushes,
+        "avg_flush_ms": round(buffer.avg_latency * 1000, 2),
+    }
+
+
+async def rollover(directory, rows):
+    """
+    Seeds MonthlyStats with rows spread evenly over the months kept as of the previous month, then times the
+    rollover into a new month, which prunes the month that has just left the kept window and vacuums its pages.
+    """
+    db = await open_database(directory, "rollover.db")
+    now = dt.datetime(2024, 5, 1, 0, 0, 30, tzinfo=dt.timezone.utc)
+    months = recent_months(dt.date(2024, 4, 1), MONTHS_KEPT)
+    users = max(1, rows // len(months))
+    async with db.transaction() as conn:
+        await conn.executemany("INSERT INTO MonthlyStats (GuildID, UserID, ChannelID, TimeSpentMs, Month) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               ((GUILD_ID, user_id, TRACK_CHANNEL[user_id % len(TRACK_CHANNEL)], 3600000, month)
+                                for user_id in range(1, users + 1) for month in months))
+        await conn.execute("INSERT INTO Rollovers (Kind, Period, CompletedAt) VALUES ('month', '2024-04', ?)",
+                           (now.isoformat(),))
+
+    start = time.perf_counter()
+    periods = await run_rollovers(db, now)
+    wall = time.perf_counter() - start
+
+    async with db.read() as conn:
+        async with conn.execute("SELECT COUNT(*) FROM MonthlyStats WHERE Month = ?", (months[-1],)) as cursor:
+            left = (await cursor.fetchone())[0]
+        async with conn.execute("PRAGMA freelist_count") as cursor:
+            free = (await cursor.fetchone())[0]
+    await db.close()
+    if periods != ["2024-05"] or left or free:
+        raise RuntimeError(f"rollover did not prune as expected: ran {periods}, {left} rows and {free} free pages left")
+    return {"rows": users * len(months), "wall_s": round(wall, 3)}
+
+
+async def run(options):
+    guild = FakeGuild(GUILD_ID)
+    tracked = [FakeChannel(channel_id, guild) for channel_id in TRACK_CHANNEL]
+    untracked = FakeChannel(1, guild)
+    channels = tracked + [untracked]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        results["steady"] = await replay(directory, "steady.db",
+                                         steady_stream(options.members, tracked, untracked, options.seed),
+                                         guild, tracked, channels)
+        results["storm"] = await replay(directory, "storm.db",
+                                        storm_stream(options.members // 5, tracked, options.bursts, options.seed),
+                                        guild, tracked, channels)
+        results["flap"] = await replay(directory, "flap.db",
+                                       flap_stream(options.members // 5, tracked, options.drops, options.seed),
+                                       guild, tracked, channels)
+        # The same stream with every leave written straight away, for the session count without debouncing
+        grace, voiceListener.FLAP_GRACE = voiceListener.FLAP_GRACE, 0
+        try:
+            results["flap_undebounced"] = await replay(directory, "flapUndebounced.db",
+                                                       flap_stream(options.members // 5, tracked, options.drops,
+                                                                   options.seed),
+                                                       guild, tracked, channels)
+        finally:
+            voiceListener.FLAP_GRACE = grace
+        results["rollover"] = await rollover(directory, options.rows)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each metric next to its baseline and returns the names of those that got worse by more than tolerance.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            if metric not in HIGHER_IS_BETTER:
+                continue
+            old = baseline.get(scenario, {}).get(metric)
+            if not old:
+                print(f"  {scenario}.{metric}: {value}")
+                continue
+            change = (value - old) / old
+            worse = -change if HIGHER_IS_BETTER[metric] else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            print(f"  {scenario}.{metric}: {value} (baseline {old}, {change:+.0%}){flag}")
+            if flag:
+                regressions.append(f"{scenario}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice ingest and rollover benchmarks.")
+    parser.add_argument("--members", type=int, default=10000, help="Members in the steady join/hop/leave stream")
+    parser.add_argument("--bursts", type=int, default=5, help="Join/leave bursts in the event storm")
+    parser.add_argument("--drops", type=int, default=3, help="Times each member reconnects in the flap stream")
+    parser.add_argument("--rows", type=int, default=1000000, help="MonthlyStats rows seeded for the rollover")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--quick", action="store_true", help="Run a tenth of the default workload")
+    parser.add_argument("--save", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fraction a metric may worsen by before it is reported as a regression")
+    options = parser.parse_args()
+    if options.quick:
+        options.members //= 10
+        options.rows //= 10
+
+    params = {"members": options.members, "bursts": options.bursts, "drops": options.drops, "rows": options.rows,
+              "seed": options.seed}
+    results = asyncio.run(run(options))
+
+    baseline = None
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as file:
+            baseline = json.load(file)
+    if baseline is not None and baseline.get("params") == params:
+        regressions = compare(results, baseline["results"], options.tolerance)
+    else:
+        if baseline is not None:
+            print("Baseline was recorded with different parameters, not comparing")
+        regressions = compare(results, {}, options.tolerance)
+
+    if options.save:
+        with open(BASELINE, "w") as file:
+            json.dump({"params": params, "python": sys.version.split()[0], "results": results}, file, indent=2)
+            file.write("\n")
+        print(f"Saved baseline to {BASELINE}")
+    elif regressions:
+        print(f"{len(regressions)} metric(s) regressed beyond {options.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
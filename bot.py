@@ -1,34 +1,72 @@
 import discord
 from discord.ext import commands
 import os
+import time
 from os import getenv
 from dotenv import load_dotenv
-from config import LOG_ID, PREFIX, OWNERS
+from config import LOG_ID, PREFIX, OWNERS, DB_PATH, DB_READERS, SHARD_COUNT, LEAN_GATEWAY, CHART_WORKERS, \
+    CHART_CACHE_SIZE, CHART_TTL
+from utils.charts import ChartRenderer
+from utils.database import Database
+from utils.sessionTracker import SessionTracker
+from utils.gateway import gateway_options
+from utils.statsRepository import StatsRepository
+from utils.trackedChannels import TrackedChannels
+from utils.utils import resident_memory
 
 load_dotenv()
+STARTED = time.perf_counter()
 
 
-class Bot(commands.Bot):
+class Bot(commands.AutoShardedBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = Database(DB_PATH, readers=DB_READERS)
+        self.stats = StatsRepository(self.db)
+        self.tracked = TrackedChannels(self.db)
+        self.sessions = SessionTracker()
+        self.charts = ChartRenderer(CHART_WORKERS, CHART_CACHE_SIZE, CHART_TTL)
+
+    async def start(self, *args, **kwargs):
+        await self.db.open()
+        await self.tracked.load()
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        await super().close()
+        # Let cogs write out anything they are holding before the database goes away
+        for cog in list(self.cogs.values()):
+            shutdown = getattr(cog, "shutdown", None)
+            if shutdown is not None:
+                await shutdown()
+        await self.db.close()
+        self.charts.close()
+
     async def on_ready(self):
         # Print startup message
-        startup = bot.user.name + " is running"
+        startup = self.user.name + " is running"
         print(startup)
         print("-" * len(startup))  # Print a line of dashes as long as the last print line for neatness
-        await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.playing, name=f"Squad"))
+        ready = f"Ready after {time.perf_counter() - STARTED:.1f}s"
+        memory = resident_memory()
+        print(ready if memory is None else f"{ready}, {memory:.0f} MB resident")
+        await self.change_presence(activity=discord.Activity(type=discord.ActivityType.playing, name=f"Squad"))
 
         channel = self.get_channel(LOG_ID)
         await channel.send(f"<@114352655857483782> - restart detected.")
 
 
-intents = discord.Intents.all()
-bot = Bot(command_prefix=commands.when_mentioned_or(PREFIX), messages=True, case_insensitive=True, owner_ids=OWNERS,
-          allowed_mentions=discord.AllowedMentions(roles=False, everyone=False), intents=intents)
+# Chart workers are spawned processes that import this file as __mp_main__, they must not start a bot of their own
+if __name__ == "__main__":
+    bot = Bot(command_prefix=commands.when_mentioned_or(PREFIX), messages=True, case_insensitive=True,
+              owner_ids=OWNERS, allowed_mentions=discord.AllowedMentions(roles=False, everyone=False),
+              shard_count=SHARD_COUNT, **gateway_options(LEAN_GATEWAY))
 
-# Load cogs
-for filename in os.listdir('./cogs'):
-    if filename.endswith('.py'):
-        print("Loading: cogs." + filename[:-3])
-        bot.load_extension("cogs." + filename[:-3])
+    # Load cogs
+    for filename in os.listdir('./cogs'):
+        if filename.endswith('.py'):
+            print("Loading: cogs." + filename[:-3])
+            bot.load_extension("cogs." + filename[:-3])
 
-# Start the bot
-bot.run(getenv("BOT_TOKEN"))
+    # Start the bot
+    bot.run(getenv("BOT_TOKEN"))
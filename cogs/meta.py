@@ -1,10 +1,22 @@
+import io
+import sqlite3
+import typing
 import discord
 from discord.ext import commands
-from config import GUILD_ID, KEIRAN_ID
-import aiosqlite
+from config import KEIRAN_ID, EXPORT_MAX_ROWS, EXPORT_TIMEOUT, DUMP_TIMEOUT, PROFILE_MAX_SECONDS, PROFILE_TOP
+from utils.export import STATS_TABLES, export_query, export_tables
+from utils.profiling import Profiler
+from utils.utils import utc_now, week_start
+
+
+def upload_limit(ctx):
+    return ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
 
 
 class Meta(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.profiler = Profiler(PROFILE_TOP)
 
     @commands.command()
     @commands.has_permissions(manage_messages=True)
@@ -17,31 +29,114 @@ class Meta(commands.Cog):
 
     @commands.command()
     @commands.has_role(KEIRAN_ID)
-    async def querydb(self, ctx, *, query: str):
-        async with aiosqlite.connect("data.db") as db:
-            async with db.execute(query) as Data:
-                entry = await Data.fetchall()
-                for detail in entry:
-                    await ctx.send(content=detail)
+    async def querydb(self, ctx, fmt: typing.Optional[typing.Literal["csv", "jsonl"]] = "csv", *, query: str):
+        """
+        Runs a read-only query and sends the result as a CSV (or JSON Lines) attachment.
+        """
+        try:
+            async with self.bot.db.read() as db:
+                result = await export_query(db, query, fmt=fmt, max_rows=EXPORT_MAX_ROWS, timeout=EXPORT_TIMEOUT)
+        except sqlite3.Error as error:
+            if str(error) == "interrupted":
+                error = f"took longer than {EXPORT_TIMEOUT} seconds"
+            elif str(error) == "not authorized":
+                error = "only read-only SELECT queries can be run"
+            await ctx.send(content=f"Query failed: {error}")
+            return
+
+        if result.size > upload_limit(ctx):
+            await ctx.send(content=f"{result.rows} rows is too large to upload, narrow the query.")
+            return
+        note = f" (cut off at {EXPORT_MAX_ROWS})" if result.truncated else ""
+        await ctx.send(content=f"{result.rows} rows{note}", file=discord.File(result.buffer, f"query.{fmt}"))
+
+    @commands.command()
+    @commands.is_owner()
+    async def statsdump(self, ctx, fmt: typing.Literal["csv", "jsonl"] = "csv"):
+        """
+        Sends every stats table as a gzipped attachment, all read from the same snapshot.
+        """
+        async with ctx.typing():
+            try:
+                async with self.bot.db.read() as db:
+                    results = await export_tables(db, STATS_TABLES, fmt=fmt, timeout=DUMP_TIMEOUT)
+            except sqlite3.Error as error:
+                await ctx.send(content=f"Dump failed: {error}")
+                return
+
+        limit = upload_limit(ctx)
+        files = [discord.File(result.buffer, f"{table}.{fmt}.gz") for table, result in results.items()
+                 if result.size <= limit]
+        summary = "\n".join(f"{table}: {result.rows} rows" + (" (too large to upload)" if result.size > limit else "")
+                            for table, result in results.items())
+        await ctx.send(content=summary, files=files)
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, kind: typing.Literal["cpu", "memory"] = "cpu", seconds: int = 60):
+        """
+        Profiles the running bot for a number of seconds (or until +profilestop) and sends the report. cpu shows the
+        hottest functions, memory the lines that allocated the most.
+        """
+        if self.profiler.kind is not None:
+            await ctx.send(content=f"A {self.profiler.kind} profile is already running, +profilestop ends it.")
+            return
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+        await ctx.send(content=f"Profiling {kind} for up to {seconds} seconds.")
+        result = await self.profiler.run(kind, seconds)
+
+        limit = upload_limit(ctx)
+        files = [discord.File(io.BytesIO(data), name) for name, data in result.files.items() if len(data) <= limit]
+        note = "" if len(files) == len(result.files) else " (some files were too large to upload)"
+        await ctx.send(content=f"{result.summary}{note}", files=files)
+
+    @commands.command()
+    @commands.is_owner()
+    async def profilestop(self, ctx):
+        """
+        Ends a running +profile early, its report is sent straight away.
+        """
+        if not self.profiler.stop():
+            await ctx.send(content="No profile is running.")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def track(self, ctx, *, channel: discord.VoiceChannel):
+        """
+        Starts tracking time spent in a voice channel.
+        """
+        if not await self.bot.tracked.add(ctx.guild.id, channel.id):
+            await ctx.send(content=f"{channel.mention} is already tracked.")
+            return
+        self.bot.dispatch("tracking_changed")
+        await ctx.send(content=f"Now tracking {channel.mention}")
+
+    @commands.command()
+    @commands.guild_only()
+    @commands.has_permissions(manage_guild=True)
+    async def untrack(self, ctx, *, channel: discord.VoiceChannel):
+        """
+        Stops tracking a voice channel. Stats already recorded for it are kept.
+        """
+        if not await self.bot.tracked.remove(ctx.guild.id, channel.id):
+            await ctx.send(content=f"{channel.mention} is not tracked.")
+            return
+        self.bot.dispatch("tracking_changed")
+        await ctx.send(content=f"Stopped tracking {channel.mention}")
 
     @commands.command()
     @commands.has_role(KEIRAN_ID)
     async def dentry(self, ctx, table, *, userid: str):
-        async with aiosqlite.connect("data.db") as db:
-            if table == "m":
-                await db.execute("DELETE FROM MonthlyStats Where UserID = ?", (userid,))
-                await db.commit()
-                await ctx.send(content="Deleted from Monthly")
-            elif table == "w":
-                await db.execute("DELETE FROM WeeklyStats Where UserID = ?", (userid,))
-                await db.commit()
-                await ctx.send(content="Deleted from Weekly")
-            elif table == "a":
-                await db.execute("DELETE FROM AllTimeStats Where UserID = ?", (userid,))
-                await db.commit()
-                await ctx.send(content="Deleted from AllTime")
-            else:
-                await ctx.send(content="Error!")
+        tables = {"m": ("month", "Monthly"), "w": ("week", "Weekly"), "a": ("alltime", "AllTime")}
+        if table not in tables:
+            await ctx.send(content="Error!")
+            return
+
+        window, label = tables[table]
+        await self.bot.stats.delete_member(window, ctx.guild.id, userid, since=week_start(utc_now().date()))
+        self.bot.dispatch("stats_written")
+        await ctx.send(content=f"Deleted from {label}")
 
 
 def setup(bot):
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import discord
+from aiohttp import web
+from discord.ext import commands, tasks
+from utils import metrics
+from config import MAIN, METRICS_HOST, METRICS_PORT, LAG_INTERVAL
+
+LAG_PROBE = 0.1  # Seconds slept per lag sample, anything past this is time the loop was busy elsewhere
+
+
+class Metrics(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.started = {}  # Invocation context -> perf_counter when the command was invoked
+        self.runner = None
+        self.lag_loop.start()
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.shutdown())
+
+    async def shutdown(self):
+        self.lag_loop.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    @tasks.loop(seconds=LAG_INTERVAL)
+    async def lag_loop(self):
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_PROBE)
+        lag = max(0.0, time.perf_counter() - start - LAG_PROBE)
+        metrics.LOOP_LAG_SECONDS.observe(lag)
+        metrics.LOOP_LAG.set(lag)
+
+    @lag_loop.before_loop
+    async def before_lag_loop(self):
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.runner is not None or METRICS_PORT is None:
+            return
+
+        async def scrape(request):
+            return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", scrape)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, METRICS_HOST, METRICS_PORT).start()
+        print(f"Metrics served on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    # Command timing, for slash and prefix commands alike
+
+    def command_started(self, ctx):
+        self.started[ctx] = time.perf_counter()
+
+    def command_finished(self, ctx, status):
+        start = self.started.pop(ctx, None)
+        name = ctx.command.qualified_name if ctx.command else "unknown"
+        metrics.COMMANDS.inc(command=name, status=status)
+        if start is not None:
+            metrics.COMMAND_SECONDS.observe(time.perf_counter() - start, command=name)
+
+    @commands.Cog.listener()
+    async def on_application_command(self, ctx):
+        self.command_started(ctx)
+
+    @commands.Cog.listener()
+    async def on_application_command_completion(self, ctx):
+        self.command_finished(ctx, "ok")
+
+    @commands.Cog.listener()
+    async def on_application_command_error(self, ctx, error):
+        self.command_finished(ctx, "error")
+
+    @commands.Cog.listener()
+    async def on_command(self, ctx):
+        self.command_started(ctx)
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        self.command_finished(ctx, "ok")
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        self.command_finished(ctx, "error")
+
+    @commands.command(name="metrics")
+    @commands.is_owner()
+    async def show_metrics(self, ctx):
+        """
+        Shows latency percentiles and counters for the voice listener, database, commands and event loop.
+        """
+        em = discord.Embed(title="Bot Metrics", colour=MAIN, timestamp=discord.utils.utcnow())
+        for title, histogram in (("Voice events", metrics.VOICE_EVENT_SECONDS),
+                                 ("Voice flushes", metrics.FLUSH_SECONDS),
+                                 ("DB reads", metrics.DB_READ_SECONDS),
+                                 ("DB read pool wait", metrics.DB_READ_WAIT_SECONDS),
+                                 ("DB transactions", metrics.DB_TRANSACTION_SECONDS),
+                                 ("DB write lock wait", metrics.DB_LOCK_WAIT_SECONDS),
+                                 ("Event loop lag", metrics.LOOP_LAG_SECONDS)):
+            series = histogram.labels()
+            em.add_field(name=title, value=f"{series.count} samples\np50 {series.quantile(0.5) * 1000:.2f} ms\n"
+                                           f"p99 {series.quantile(0.99) * 1000:.2f} ms")
+
+        events = ", ".join(f"{dict(key)['kind']} {value}" for key, value in metrics.VOICE_EVENTS.values.items())
+        em.add_field(name="Voice", value=f"Events: {events or 'none'}\n"
+                                         f"Open sessions: {metrics.OPEN_SESSIONS.get()}\n"
+                                         f"Buffered: {metrics.BUFFER_DEPTH.get()}\n"
+                                         f"Sessions written: {metrics.SESSIONS_WRITTEN.total()}", inline=False)
+        em.add_field(name="Database", value=f"Commits: {metrics.DB_COMMITS.total()}\n"
+                                            f"Rollbacks: {metrics.DB_ROLLBACKS.total()}\n"
+                                            f"Rows written: {metrics.ROWS_WRITTEN.total()}", inline=False)
+
+        slowest = sorted(metrics.COMMAND_SECONDS.series.items(), key=lambda item: item[1].quantile(0.99),
+                         reverse=True)[:5]
+        commands_run = "\n".join(f"{dict(key)['command']}: {series.count} runs, "
+                                 f"p99 {series.quantile(0.99) * 1000:.0f} ms" for key, series in slowest)
+        em.add_field(name="Slowest commands", value=commands_run or "None run yet", inline=False)
+        await ctx.send(embed=em)
+
+
+def setup(bot):
+    bot.add_cog(Metrics(bot))
@@ -0,0 +1,34 @@
+from discord.ext import commands, tasks
+from utils.rollover import run_rollovers
+from utils.utils import utc_now
+from config import ROLLOVER_INTERVAL
+
+
+class Rollover(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.rollover_loop.start()
+
+    def cog_unload(self):
+        self.rollover_loop.cancel()
+
+    @tasks.loop(minutes=ROLLOVER_INTERVAL)
+    async def rollover_loop(self):
+        try:
+            periods = await run_rollovers(self.bot.db, utc_now())
+        except Exception as error:
+            print(f"Rollover failed: {error!r}")
+            return
+
+        for period in periods:
+            print(f"Rolled over {period}")
+        if periods:
+            self.bot.dispatch("stats_written")
+
+    @rollover_loop.before_loop
+    async def before_rollover_loop(self):
+        await self.bot.wait_until_ready()
+
+
+def setup(bot):
+    bot.add_cog(Rollover(bot))
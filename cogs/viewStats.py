@@ -1,129 +1,176 @@
 import discord
 from discord.commands import SlashCommandGroup
 from discord.ext import commands, pages
-import datetime
 from config import MAIN
 import time
-import aiosqlite
-from utils.utils import utc_now
-from config import GUILD_ID, TRACK_CHANNEL
+import io
+from utils.statsRepository import ALL_CHANNELS
+from utils.utils import utc_now, week_start, format_duration, recent_months, month_name, month_key, recent_weeks
+from utils.charts import bar_chart, line_chart, hours
+from utils.occupancy import heatmap_grid, busiest_hours
+
+
+TREND_WEEKS = 12  # Weeks on the /weeklystats chart, the rollover keeps about 13
+
+
+def channel_name(guild, channel_id):
+    channel = guild.get_channel(channel_id)
+    return f"#{channel.name}" if channel is not None else str(channel_id)
 
 
 class ViewStats(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    @discord.slash_command(guild_ids=[GUILD_ID])
-    async def alltimestats(self, ctx: discord.ApplicationContext, member: discord.Member):
-        UserID = member.id
-        async with aiosqlite.connect("data.db") as db:
-            async with db.execute("SELECT * FROM AllTimeStats WHERE UserID = ?", (UserID,)) as UserStats:
-                entry = await UserStats.fetchall()
-                em = discord.Embed(title=f"🔊 {member.display_name}'s All Time Voice Stats 🔊", colour=MAIN,
-                                   timestamp=discord.utils.utcnow())
-                for detail in entry:
-                    minutes, seconds = divmod(detail[2], 60)
-                    hours, minutes = divmod(minutes, 60)
-                    days, hours = divmod(hours, 24)
-                    if days >= 1:
-                        em.add_field(name="Channel:", value=f" <#{detail[1]}> Time: {int(days)} days, {int(hours)} hours,"
-                                                            f" {int(minutes)} minutes, {round(seconds, 2)} seconds", inline=False)
-                    else:
-                        if hours >= 1:
-                            em.add_field(name="Channel:", value=f" <#{detail[1]}> Time: {int(hours)} hours,"
-                                                                f" {int(minutes)} minutes, {round(seconds, 2)} seconds", inline=False)
-                        else:
-                            if minutes >= 1:
-                                em.add_field(name="Channel:", value=f" <#{detail[1]}> Time: {int(minutes)} minutes,"
-                                                                    f" {round(seconds, 2)} seconds",
-                                             inline=False)
-                            else:
-                                em.add_field(name="Channel:", value=f" <#{detail[1]}> Time: {round(seconds, 2)} seconds",
-                                             inline=False)
-                em.set_footer(text="These stats are updated on the first day of every month!")
-            await ctx.respond(embed=em)
-
-    @discord.slash_command(guild_ids=[GUILD_ID])
-    async def weeklystats(self, ctx: discord.ApplicationContext, member: discord.Member):
-        UserID = member.id
-        async with aiosqlite.connect("data.db") as db:
-            async with db.execute("SELECT * FROM WeeklyStats WHERE UserID = ?", (UserID,)) as UserStats:
-                entry = await UserStats.fetchall()
-                em = discord.Embed(title=f"🔊 {member.display_name}'s Weekly Voice Stats 🔊", colour=MAIN,
-                                   timestamp=discord.utils.utcnow())
-                for detail in entry:
-                    minutes, seconds = divmod(detail[2], 60)
-                    hours, minutes = divmod(minutes, 60)
-                    days, hours = divmod(hours, 24)
-                    if days >= 1:
-                        em.add_field(name="Channel:",
-                                     value=f" <#{detail[1]}> Time: {int(days)} days, {int(hours)} hours,"
-                                           f" {int(minutes)} minutes, {round(seconds, 2)} seconds", inline=False)
-                    else:
-                        if hours >= 1:
-                            em.add_field(name="Channel:", value=f" <#{detail[1]}> Time: {int(hours)} hours,"
-                                                                f" {int(minutes)} minutes, {round(seconds, 2)} seconds",
-                                         inline=False)
-                        else:
-                            if minutes >= 1:
-                                em.add_field(name="Channel:", value=f" <#{detail[1]}> Time: {int(minutes)} minutes,"
-                                                                    f" {round(seconds, 2)} seconds",
-                                             inline=False)
-                            else:
-                                em.add_field(name="Channel:",
-                                             value=f" <#{detail[1]}> Time: {round(seconds, 2)} seconds",
-                                             inline=False)
-            await ctx.respond(embed=em)
-
-    @discord.slash_command(guild_ids=[GUILD_ID])
-    async def monthlystats(self, ctx: discord.ApplicationContext, member: discord.Member):
-        UserID = member.id
-        async with aiosqlite.connect("data.db") as db:
-            current_month = datetime.datetime.utcnow().month
-            target_months = [(current_month - i) % 12 for i in range(3)]
-
-            em = discord.Embed(title=f"🔊 {member.display_name}'s Monthly Voice Stats 🔊", colour=MAIN,
-                               timestamp=discord.utils.utcnow())
-
-            for target_month in target_months:
-                async with db.execute("SELECT * FROM MonthlyStats WHERE UserID = ? AND Month = ?",
-                                      (UserID, target_month)) as UserStats:
-                    entry = await UserStats.fetchall()
-                    month_name = datetime.date(1900, target_month, 1).strftime("%B")
-                    month_stats = ""
-
-                    for detail in entry:
-                        minutes, seconds = divmod(detail[2], 60)
-                        hours, minutes = divmod(minutes, 60)
-                        days, hours = divmod(hours, 24)
-
-                        if days >= 1:
-                            month_stats += f"Channel: <#{detail[1]}> Time: {int(days)} days, {int(hours)} hours," \
-                                           f" {int(minutes)} minutes, {round(seconds, 2)} seconds\n"
-                        elif hours >= 1:
-                            month_stats += f"Channel: <#{detail[1]}> Time: {int(hours)} hours, {int(minutes)} minutes," \
-                                           f" {round(seconds, 2)} seconds\n"
-                        elif minutes >= 1:
-                            month_stats += f"Channel: <#{detail[1]}> Time: {int(minutes)} minutes," \
-                                           f" {round(seconds, 2)} seconds\n"
-                        else:
-                            month_stats += f"Channel: <#{detail[1]}> Time: {round(seconds, 2)} seconds\n"
-
-                    if month_stats:
-                        em.add_field(name=f"{month_name}", value=month_stats, inline=False)
-                    else:
-                        em.add_field(name=f"{month_name}", value="No data available", inline=False)
+    async def respond_with_chart(self, ctx, em, name, draw, *args):
+        """
+        Renders a chart off the event loop and sends it as the embed's image.
+        """
+        png = await self.bot.charts.render(draw, *args)
+        em.set_image(url=f"attachment://{name}.png")
+        await ctx.respond(embed=em, file=discord.File(io.BytesIO(png), filename=f"{name}.png"))
+
+    @discord.slash_command(guild_only=True)
+    async def alltimestats(self, ctx: discord.ApplicationContext, member: discord.Member,
+                           chart: discord.Option(bool, "Attach a chart", default=False)):
+        if chart:
+            await ctx.defer()
+        entry = await self.bot.stats.member_alltime(ctx.guild.id, member.id)
+        em = discord.Embed(title=f"🔊 {member.display_name}'s All Time Voice Stats 🔊", colour=MAIN,
+                           timestamp=discord.utils.utcnow())
+        for channel_id, seconds in entry:
+            em.add_field(name="Channel:", value=f" <#{channel_id}> Time: {format_duration(seconds)}", inline=False)
+        em.set_footer(text="Includes time in voice right now")
+        if chart and entry:
+            ranked = sorted(entry, key=lambda row: row.seconds, reverse=True)
+            return await self.respond_with_chart(ctx, em, "alltime", bar_chart,
+                                                 f"{member.display_name} - All Time",
+                                                 tuple(channel_name(ctx.guild, channel_id) for channel_id, _ in ranked),
+                                                 tuple(hours(seconds) for _, seconds in ranked))
+        await ctx.respond(embed=em)
+
+    @discord.slash_command(guild_only=True)
+    async def weeklystats(self, ctx: discord.ApplicationContext, member: discord.Member,
+                          chart: discord.Option(bool, "Attach a chart", default=False)):
+        if chart:
+            await ctx.defer()
+        today = utc_now().date()
+        entry = await self.bot.stats.member_week(ctx.guild.id, member.id, week_start(today))
+        em = discord.Embed(title=f"🔊 {member.display_name}'s Weekly Voice Stats 🔊", colour=MAIN,
+                           timestamp=discord.utils.utcnow())
+        for channel_id, seconds in entry:
+            em.add_field(name="Channel:", value=f" <#{channel_id}> Time: {format_duration(seconds)}", inline=False)
+        if chart:
+            # Trend over the weeks still on record, oldest first
+            weeks = await self.bot.stats.member_weeks(ctx.guild.id, member.id, recent_weeks(today, TREND_WEEKS)[::-1])
+            return await self.respond_with_chart(ctx, em, "weekly", line_chart,
+                                                 f"{member.display_name} - Weekly Trend",
+                                                 tuple(week.strftime("%d %b") for week in weeks),
+                                                 (("All channels", tuple(map(hours, weeks.values()))),))
+        await ctx.respond(embed=em)
+
+    @discord.slash_command(guild_only=True)
+    async def monthlystats(self, ctx: discord.ApplicationContext, member: discord.Member,
+                           chart: discord.Option(bool, "Attach a chart", default=False)):
+        if chart:
+            await ctx.defer()
+        target_months = recent_months(utc_now(), 3)
+        months = await self.bot.stats.member_months(ctx.guild.id, member.id, target_months)
 
+        em = discord.Embed(title=f"🔊 {member.display_name}'s Monthly Voice Stats 🔊", colour=MAIN,
+                           timestamp=discord.utils.utcnow())
+        for target_month in target_months:
+            month_stats = "".join(f"Channel: <#{channel_id}> Time: {format_duration(seconds)}\n"
+                                  for channel_id, seconds in months[target_month])
+            em.add_field(name=month_name(target_month), value=month_stats or "No data available", inline=False)
+
+        channel_ids = sorted({channel_id for rows in months.values() for channel_id, _ in rows})
+        if chart and channel_ids:
+            # One line per channel across the months, oldest first
+            by_month = [dict(months[target_month]) for target_month in reversed(target_months)]
+            return await self.respond_with_chart(ctx, em, "monthly", line_chart,
+                                                 f"{member.display_name} - Monthly",
+                                                 tuple(month_name(target_month) for target_month in
+                                                       reversed(target_months)),
+                                                 tuple((channel_name(ctx.guild, channel_id),
+                                                        tuple(hours(month.get(channel_id, 0)) for month in by_month))
+                                                       for channel_id in channel_ids))
+        await ctx.respond(embed=em)
+
+    @discord.slash_command(guild_only=True)
+    async def rank(self, ctx: discord.ApplicationContext,
+                   window: discord.Option(str, "Leaderboard to look at", choices=["alltime", "weekly", "monthly"],
+                                          default="alltime"),
+                   member: discord.Option(discord.Member, "Defaults to you", required=False, default=None),
+                   channel: discord.Option(discord.VoiceChannel, "Only count time in this channel", required=False,
+                                           default=None)):
+        """
+        Shows where a member places on this server's voice leaderboard.
+        """
+        member = member or ctx.author
+        today = utc_now().date()
+        kind, period, label = {"alltime": ("alltime", "", "All Time"),
+                               "weekly": ("week", week_start(today).isoformat(), "This Week"),
+                               "monthly": ("month", month_key(today), month_name(month_key(today)))}[window]
+        channel_id = channel.id if channel is not None else ALL_CHANNELS
+        place = await self.bot.stats.rank(kind, period, ctx.guild.id, member.id, channel_id)
+
+        em = discord.Embed(title=f"🔊 {member.display_name}'s Rank - {label} 🔊", colour=MAIN,
+                           timestamp=discord.utils.utcnow())
+        if channel is not None:
+            em.description = channel.mention
+        if place is None:
+            em.add_field(name="Rank", value="No time recorded yet", inline=False)
+        else:
+            em.add_field(name="Rank", value=f"#{place.rank} of {place.members}")
+            em.add_field(name="Percentile", value=f"{place.percentile:.1f}")
+            em.add_field(name="Time", value=format_duration(place.seconds))
+        await ctx.respond(embed=em)
+
+    @discord.slash_command(guild_only=True)
+    async def heatmap(self, ctx: discord.ApplicationContext,
+                      channel: discord.Option(discord.VoiceChannel, "A tracked voice channel", required=False,
+                                              default=None),
+                      role: discord.Option(discord.Role, "Every tracked channel this role can join",
+                                           required=False, default=None)):
+        """
+        Shows when tracked channels are busiest, by hour of the week.
+        """
+        tracked = self.bot.tracked.for_guild(ctx.guild.id)
+        if channel is not None:
+            if channel.id not in tracked:
+                return await ctx.respond(f"{channel.mention} is not tracked.", ephemeral=True)
+            channels, subject = [channel], channel.mention
+        elif role is not None:
+            channels = [tracked_channel for tracked_channel in map(ctx.guild.get_channel, sorted(tracked))
+                        if tracked_channel is not None and tracked_channel.permissions_for(role).connect]
+            if not channels:
+                return await ctx.respond(f"{role.mention} cannot join any tracked channel.", ephemeral=True)
+            subject = role.mention
+        else:
+            return await ctx.respond("Pick a channel or a role.", ephemeral=True)
+
+        cells = await self.bot.stats.occupancy(ctx.guild.id, [tracked_channel.id for tracked_channel in channels])
+        em = discord.Embed(title="🔊 Voice Heatmap 🔊", description=f"{subject}\n```\n{heatmap_grid(cells)}\n```",
+                           colour=MAIN, timestamp=discord.utils.utcnow())
+        busiest = "".join(f"{label}: {format_duration(cell.seconds)}, peak {cell.peak}\n"
+                          for label, cell in busiest_hours(cells, 5))
+        em.add_field(name="Busiest hours", value=busiest or "No data available", inline=False)
+        if role is not None:
+            em.add_field(name="Channels", value=" ".join(tracked_channel.mention for tracked_channel in channels),
+                         inline=False)
+        em.set_footer(text="Hours are UTC")
         await ctx.respond(embed=em)
 
-    @discord.slash_command(guild_ids=[GUILD_ID])
+    @discord.slash_command(guild_only=True)
     async def tracking(self, ctx: discord.ApplicationContext):
         em = discord.Embed(title=f"Current Tracking",
                            colour=MAIN, timestamp=discord.utils.utcnow())
         em.add_field(name="Channels:", value="", inline=False)
-        for x in TRACK_CHANNEL:
-            channel_id = ctx.guild.get_channel(x).id
-            em.add_field(name="", value=f"\n<#{channel_id}> ", inline=False)
+        for channel_id in sorted(self.bot.tracked.for_guild(ctx.guild.id)):
+            users = self.bot.sessions.headcount(channel_id)
+            em.add_field(name="", value=f"\n<#{channel_id}> {users} in voice" if users else f"\n<#{channel_id}> ",
+                         inline=False)
 
         await ctx.respond(embed=em)
 
@@ -1,185 +1,229 @@
-import datetime
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import time
-import aiosqlite
-from utils.utils import utc_now
-from config import TRACK_CHANNEL
-
-time_start = {}
-
-
-async def move_data_to_monthly(db):
-    current_month = datetime.datetime.utcnow().month
-
-    async with db.execute("SELECT * FROM WeeklyStats") as weekly_cursor:
-        async for weekly_row in weekly_cursor:
-            user_id = weekly_row[0]
-            channel_id = weekly_row[1]
-            time_spent = weekly_row[2]
-            time_spent = round(time_spent, 2)
-
-            # Check if the row exists in MonthlyStats
-            matching_row = await db.execute(
-                "SELECT * FROM MonthlyStats WHERE UserID = ? AND ChannelID = ?",
-                (user_id, channel_id))
-            matching_row = await matching_row.fetchone()
-
-            if matching_row:
-                # If the row exists, update the TimeSpent
-                new_time_spent = matching_row[2] + time_spent
-                new_time_spent = round(new_time_spent, 2)
-                await db.execute(
-                    "UPDATE MonthlyStats SET TimeSpent = ? WHERE UserID = ? AND ChannelID = ?",
-                    (new_time_spent, user_id, channel_id))
-                await db.commit()
-            else:
-                # If the row doesn't exist, insert a new row with TimeSpent and current month
-                await db.execute(
-                    "INSERT INTO MonthlyStats (UserID, ChannelID, TimeSpent, Month) VALUES (?, ?, ?, ?)",
-                    (user_id, channel_id, time_spent, current_month))
-                await db.commit()
-
-
-async def monthly_wipe(db):
-    current_month = datetime.datetime.utcnow().month
-    target_month = (current_month - 3) % 12
-
-    await db.execute("DELETE FROM MonthlyStats WHERE Month = ?", (target_month,))
-    await db.commit()
-
-
-async def weekly_wipe(db):
-    if datetime.datetime.utcnow().weekday() == 0:
-        await move_data_to_monthly(db)
-        await db.execute("DELETE FROM WeeklyStats")
-        await db.commit()
-
-
-async def update_alltime_stats(db):
-    day_number = int(utc_now().day)
-    month_number = int(utc_now().month)
-    await db.execute("UPDATE AllTimeStats SET TimeSpent = COALESCE((SELECT SUM(TimeSpent) FROM WeeklyStats "
-                     "WHERE WeeklyStats.UserID = AllTimeStats.UserID AND WeeklyStats.ChannelID ="
-                     " AllTimeStats.ChannelID), 0) + TimeSpent "
-                     "WHERE EXISTS (SELECT 1 FROM WeeklyStats "
-                     "WHERE WeeklyStats.UserID = AllTimeStats.UserID AND WeeklyStats.ChannelID ="
-                     " AllTimeStats.ChannelID)")
-    await db.commit()
-    await db.execute("UPDATE LastUpdated SET Date=?, Month=?", (day_number, month_number))
-    await db.commit()
-
-
-async def move_data(db):
-    weekly_cursor = await db.execute("SELECT * FROM WeeklyStats")
-    all_time_cursor = await db.execute("SELECT * FROM AllTimeStats")
-
-    async for weekly_row in weekly_cursor:
-        user_id = weekly_row[0]
-        channel_id = weekly_row[1]
-        time_spent = weekly_row[2]
-        time_spent = round(time_spent, 2)
-
-        matching_row = await all_time_cursor.execute("SELECT * FROM AllTimeStats WHERE UserID = ? AND ChannelID = ?",
-                                                     (user_id, channel_id))
-        matching_row = await matching_row.fetchone()
-        if matching_row:
-            new_time_spent = matching_row[2] + time_spent
-            new_time_spent = round(new_time_spent, 2)
-            await db.execute("UPDATE AllTimeStats SET TimeSpent = ? WHERE UserID = ? AND ChannelID = ?",
-                             (new_time_spent, user_id, channel_id))
-            await db.commit()
-        else:
-            # Insert a new row with TimeSpent initialized to zero
-            await db.execute("INSERT INTO AllTimeStats (UserID, ChannelID, TimeSpent) VALUES (?, ?, 0)",
-                             (user_id, channel_id))
-            await db.commit()
-
-            # Retrieve the new row and update TimeSpent with the weekly time spent
-            rows = await db.execute("SELECT * FROM AllTimeStats WHERE UserID = ? AND ChannelID = ?",
-                                    (user_id, channel_id))
-            new_row = await rows.fetchone()
-            new_time_spent = new_row[2] + time_spent
-            new_time_spent = round(new_time_spent, 2)
-            await db.execute("UPDATE AllTimeStats SET TimeSpent = ? WHERE UserID = ? AND ChannelID = ?",
-                             (new_time_spent, user_id, channel_id))
-            await db.commit()
-    await db.execute("DELETE FROM WeeklyStats")
-    await db.commit()
-
-
-async def db_conversion(db):
-    if utc_now().day == 1:
-        await update_alltime_stats(db)
-        await move_data(db)
-        await weekly_wipe(db)
-        await monthly_wipe(db)
-        await db.execute("UPDATE LastUpdated SET Month=?", (utc_now().month,))
-        await db.commit()
+from utils import metrics
+from utils.liveTime import LiveTime
+from utils.writeBuffer import VoiceBuffer
+from config import MAIN, FLUSH_INTERVAL, FLUSH_THRESHOLD, RESUME_WINDOW, FLAP_GRACE
 
 
 class VoiceListener(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.channels = [] # List of all channels
+        self.sessions = bot.sessions
+        self.buffer = VoiceBuffer(bot.db, FLUSH_THRESHOLD)
+        self.recovered = False
+        self.early_flush = None  # Task for a flush started because the buffer filled up
+        self.settle_timers = {}  # (GuildID, UserID) -> TimerHandle that records a held session once its grace is up
+        # Stats reads add time that has not been written yet
+        bot.stats.live = LiveTime(self.sessions, self.buffer)
+        metrics.OPEN_SESSIONS.set_function(lambda: len(self.sessions))
+        metrics.BUFFER_DEPTH.set_function(lambda: self.buffer.depth)
+        self.flush_loop.start()
+
+    def cog_unload(self):
+        self.bot.stats.live = None
+        self.bot.loop.create_task(self.shutdown())
+
+    async def shutdown(self):
+        # Final flush so buffered time survives an unload or restart
+        self.flush_loop.cancel()
+        self.settle_all()
+        await self.flush()
+
+    async def flush(self):
+        if await self.buffer.flush():
+            # Lets cached leaderboards know the stats have changed
+            self.bot.dispatch("stats_written")
+
+    async def flush_early(self):
+        try:
+            await self.flush()
+        except Exception as error:
+            print(f"Voice buffer flush failed: {error!r}")
+        finally:
+            self.early_flush = None
+
+    def record(self, guild_id, user_id, channel_id, started_at, ended_at):
+        if self.buffer.add(guild_id, user_id, channel_id, started_at, ended_at):
+            # Buffer is full, flush now rather than waiting for the next tick. One early flush at a time, it picks
+            # up everything that arrives before it runs.
+            if self.early_flush is None:
+                self.early_flush = self.bot.loop.create_task(self.flush_early())
+
+    def hold(self, session, left_at):
+        """
+        Keeps a session that has just been left open for FLAP_GRACE seconds. Reconnects and quick hops show up as a
+        leave and a join, a rejoin in that time carries the session on instead of splitting it.
+        """
+        if FLAP_GRACE <= 0:
+            self.record(*session.key, session.channel_id, session.started_at, left_at)
+            return
+        self.sessions.hold(session, left_at)
+        self.settle_timers[session.key] = self.bot.loop.call_later(FLAP_GRACE, self.settle, session.key)
+
+    def settle(self, key):
+        """
+        Records a held session as ending when it was left. Returns the time it was left, or None if nothing was held.
+        """
+        timer = self.settle_timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        session = self.sessions.release(*key)
+        if session is None:
+            return None
+        self.record(*key, session.channel_id, session.started_at, session.left_at)
+        return session.left_at
+
+    def settle_all(self):
+        for key in list(self.sessions.held):
+            self.settle(key)
+
+    def sample_headcounts(self):
+        # Catches the peak of hours where nobody joins, such as a full channel carrying on past the hour
+        now = self.sessions.clock()
+        for guild_id, channel_ids in self.bot.tracked.by_guild.items():
+            for channel_id in channel_ids:
+                users = self.sessions.headcount(channel_id)
+                if users:
+                    self.buffer.headcount(guild_id, channel_id, users, now)
+
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flush_loop(self):
+        self.sample_headcounts()
+        try:
+            await self.flush()
+        except Exception as error:
+            # The batch stays buffered, keep the loop alive and retry on the next tick
+            print(f"Voice buffer flush failed: {error!r}")
+
+    @flush_loop.before_loop
+    async def before_flush_loop(self):
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.recovered:
+            # Reconnected without a restart, the sessions in memory are still good up to now
+            await self.reconcile({}, self.sessions.clock())
+            return
+
+        checkpoint = await self.bot.stats.open_sessions()
+        last_seen = await self.bot.stats.heartbeat()
+        self.recovered = True
+        await self.reconcile(checkpoint, last_seen)
+
+    async def reconcile(self, checkpoint, last_seen):
+        """
+        Matches open sessions from the checkpoint and from memory against who is actually sitting in the tracked
+        channels. Sessions whose member is gone are closed at last_seen, the last moment the bot knew they were
+        there. Members found without a session get one starting now.
+        """
+        # Held sessions would miss their rejoin over a reconnect, so they end where they were left
+        self.settle_all()
+        now = self.sessions.clock()
+        present = {}
+        for guild_id, channel_ids in self.bot.tracked.by_guild.items():
+            for channel_id in channel_ids:
+                channel = self.bot.get_channel(channel_id)
+                if channel is not None:
+                    for member_id in channel.voice_states:
+                        present[guild_id, member_id] = channel_id
+
+        # A checkpoint from a short outage is resumed as if the bot never left, a longer one is cut at last_seen
+        resume = last_seen is not None and now - last_seen <= RESUME_WINDOW
+        for key, (channel_id, started_at) in checkpoint.items():
+            if key in self.sessions:
+                # A voice event has already started a newer session for this member
+                continue
+            if resume and present.get(key) == channel_id:
+                self.sessions.start(*key, channel_id, started_at)
+            elif last_seen is not None and last_seen > started_at:
+                self.buffer.add(*key, channel_id, started_at, min(last_seen, now))
+            else:
+                self.buffer.forget(*key)
+
+        # Sessions held in memory were watched live, so any that missed their leave event (or whose channel is no
+        # longer tracked) end now
+        for session in self.sessions:
+            if present.get(session.key) != session.channel_id:
+                self.sessions.stop(*session.key)
+                self.buffer.add(*session.key, session.channel_id, session.started_at, now)
+
+        for key, channel_id in present.items():
+            if key not in self.sessions:
+                self.sessions.start(*key, channel_id, now)
+                self.buffer.open(*key, channel_id, now)
+
+        await self.flush()
+
+    @commands.Cog.listener()
+    async def on_tracking_changed(self):
+        # Close sessions in channels that stopped being tracked, open them for members already in new ones
+        if self.recovered:
+            await self.reconcile({}, self.sessions.clock())
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
                                     after: discord.VoiceState):
         if before.channel != after.channel:
-            if before.channel and before.channel.id in TRACK_CHANNEL:
-                if before.channel is not None:
-                    if member.id in time_start:
-                        duration = round(time.time() - time_start.get(member.id, 0), 2)
-                        del time_start[member.id]
+            start = time.perf_counter()
+            tracked = self.bot.tracked.channels
+            left = before.channel is not None and before.channel.id in tracked
+            joined = after.channel is not None and after.channel.id in tracked
+            key = (member.guild.id, member.id)
+            now = self.sessions.clock()
+            rejoined = False
+            if left:
+                session = self.sessions.stop(*key)
+                # Without a known start (the member joined before recovery ran) there is nothing to record
+                if session is not None:
+                    if joined:
+                        # A hop straight between tracked channels, the member never dropped out
+                        self.record(*key, session.channel_id, session.started_at, now)
                     else:
-                        duration = 0
-                    async with aiosqlite.connect("data.db") as db:
-                        query = "SELECT * FROM WeeklyStats WHERE UserID=? AND ChannelID=?"
-                        rows = await db.execute(query, (member.id, before.channel.id))
-                        row = await rows.fetchone()
-                        if row:
-                            # If there is a record in the db that matches the userID and current channel
-                            time_spent = row[2] + duration
-                            data = (time_spent, member.id, before.channel.id)
-                            await db.execute("UPDATE WeeklyStats SET TimeSpent=? WHERE UserID=? AND ChannelID=?", data)
-                            await db.commit()
-                            await db_conversion(db)
-                        else:
-                            # Record doesn't exist, so create it
-                            day_number = int(utc_now().day)
-                            month_number = int(utc_now().month)
-                            await db.execute("INSERT INTO WeeklyStats (UserID, ChannelID, TimeSpent) VALUES (?,?,?)",
-                                             (member.id, before.channel.id, duration))
-                            await db.commit()
-                            async with db.execute("SELECT Date FROM LastUpdated") as last_date:
-                                last_date = await last_date.fetchone()
-                                if last_date is None:
-                                    await db.execute("INSERT INTO LastUpdated (Date, Month) VALUES (?, ?)",
-                                                     (day_number, month_number))
-                                    await db.commit()
-                                else:
-                                    if before.channel != after.channel:
-                                        data = (member.id, before.channel.id)
-                                        rows = await db.execute(
-                                            "SELECT * FROM AllTimeStats WHERE UserID=? AND ChannelID=?", data)
-                                        row = await rows.fetchone()
-                                        if row:
-                                            # If there is a current record in the AllTime Table
-                                            time_spent = row[2] + duration
-                                            data = (time_spent, member.id, before.channel.id)
-                                            await db.execute(
-                                                "UPDATE AllTimeStats SET TimeSpent=? WHERE UserID=? AND ChannelID=?",
-                                                data)
-                                            await db.commit()
-                                            await db_conversion(db)
-
-            if after.channel and after.channel.id in TRACK_CHANNEL:
-                self.channels.append(after.channel.id)
-                time_start[member.id] = time.time()
+                        self.hold(session, now)
+
+            if joined:
+                session = self.sessions.held.get(key)
+                rejoined = session is not None
+                if rejoined and session.channel_id == after.channel.id:
+                    # Back in the same channel within the grace window, carry on the session as if they never left.
+                    # Its checkpoint was never cleared.
+                    self.settle_timers.pop(key).cancel()
+                    self.sessions.resume(*key)
+                else:
+                    # Rejoining elsewhere ends the held session, the new one picks up from when it was left so the
+                    # time in between is not lost
+                    started_at = self.settle(key) if rejoined else now
+                    self.sessions.start(*key, after.channel.id, started_at)
+                    self.buffer.open(*key, after.channel.id, started_at)
+                self.buffer.headcount(member.guild.id, after.channel.id, self.sessions.headcount(after.channel.id),
+                                      now)
+
+            if left or joined:
+                kind = "rejoin" if rejoined else "hop" if left and joined else "leave" if left else "join"
+                metrics.VOICE_EVENTS.inc(kind=kind)
+                metrics.VOICE_EVENT_SECONDS.observe(time.perf_counter() - start)
         else:
             return
 
+    @commands.command()
+    @commands.is_owner()
+    async def voicebuffer(self, ctx):
+        """
+        Shows the voice write buffer's queue depth and flush latency.
+        """
+        buffer = self.buffer
+        em = discord.Embed(title="Voice Write Buffer", colour=MAIN, timestamp=discord.utils.utcnow())
+        em.add_field(name="Queue depth", value=f"{buffer.depth} / {buffer.threshold}")
+        em.add_field(name="Flush interval", value=f"{FLUSH_INTERVAL} seconds")
+        em.add_field(name="Flushes", value=f"{buffer.flushes} ({buffer.rows_written} rows)")
+        em.add_field(name="Last flush", value=f"{buffer.last_latency * 1000:.1f} ms")
+        em.add_field(name="Average flush", value=f"{buffer.avg_latency * 1000:.1f} ms")
+        em.add_field(name="Slowest flush", value=f"{buffer.max_latency * 1000:.1f} ms")
+        await ctx.send(embed=em)
+
 
 def setup(bot):
     bot.add_cog(VoiceListener(bot))
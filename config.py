@@ -1,10 +1,48 @@
 PREFIX = "+"
 OWNERS = [114352655857483782, 484766198504882196, 221294694787842048, 159497287024771072]
+SHARD_COUNT = None  # None lets Discord pick the shard count for the number of guilds
+LEAN_GATEWAY = True  # Minimal intents and member cache, members are fetched when needed. False caches everything.
+# The original guild and its tracked channels. Only read once, to seed the TrackedChannels table when the database
+# is upgraded, after that channels are managed per guild with +track and +untrack.
 GUILD_ID = 706855085665288272
 TRACK_CHANNEL = [830951783731691520, 1063866105401180212, 706860265437659197, 1085366690105282590,
                  1117935012164161566, 1120811871784677457, 1119236537641619576, 1122624777845231676]
 KEIRAN_ID = 1114999083577389208
 
+# Database
+DB_PATH = "data.db"
+DB_READERS = 3  # Size of the read-only connection pool
+FLUSH_INTERVAL = 30  # Seconds between voice buffer flushes
+FLUSH_THRESHOLD = 200  # Buffered (user, channel) entries that trigger an early flush
+RESUME_WINDOW = 300  # Seconds of downtime after which open sessions are cut at the last heartbeat, not resumed
+FLAP_GRACE = 15  # Seconds a session is held after a leave, a rejoin within it carries the session on. 0 disables it
+ROLLOVER_INTERVAL = 5  # Minutes between checks for monthly rollovers
+
+# Leaderboard cache
+CACHE_SIZE = 64  # (guild, role, window) leaderboards kept
+CACHE_TTL = 300  # Seconds before a cached leaderboard is rebuilt even without new stats
+ROSTER_TTL = 600  # Seconds a guild's role rosters are kept in lean gateway mode
+
+# Metrics
+METRICS_HOST = "127.0.0.1"  # Only reachable from this machine
+METRICS_PORT = 9108  # Prometheus endpoint at /metrics, None to disable it
+LAG_INTERVAL = 1  # Seconds between event loop lag samples
+
+# Exports
+EXPORT_MAX_ROWS = 50000  # Rows +querydb writes before cutting the file off
+EXPORT_TIMEOUT = 10  # Seconds a +querydb query may run before it is aborted
+DUMP_TIMEOUT = 120  # Seconds +statsdump may spend reading every stats table
+
+# Profiling
+PROFILE_MAX_SECONDS = 600  # Longest +profile run allowed
+PROFILE_TOP = 40  # Lines in each table of a profile report
+
+# Charts
+CHART_WORKERS = 2  # Processes drawing charts
+CHART_CACHE_SIZE = 128  # Rendered images kept
+CHART_TTL = 600  # Seconds a rendered image is kept
+CHART_ROWS = 20  # Members shown on a leaderboard chart
+
 # Colours
 MAIN = 0x83B942
 RED = 0xE0495F
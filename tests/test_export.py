@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from utils.database import Database
+from utils.export import export_query, export_tables
+
+
+class ExportQueryTest(unittest.IsolatedAsyncioTestCase):
+    """
+    export_query runs on pooled read connections, so it must hand them back as it found them.
+    """
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.directory.name, "export.db"), readers=1)
+        await self.db.open()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.directory.cleanup()
+
+    async def test_reads_work_after_export(self):
+        async with self.db.read() as conn:
+            result = await export_query(conn, "SELECT 1")
+            self.assertEqual(result.rows, 1)
+            async with conn.execute("SELECT COUNT(*) FROM AllTimeStats") as cursor:
+                self.assertEqual(await cursor.fetchone(), (0,))
+            await export_tables(conn, ("AllTimeStats",))
+
+    async def test_refuses_statements_that_are_not_reads(self):
+        async with self.db.read() as conn:
+            for sql in ("BEGIN", "PRAGMA query_only = OFF", "DELETE FROM AllTimeStats"):
+                with self.assertRaisesRegex(sqlite3.DatabaseError, "not authorized"):
+                    await export_query(conn, sql)
+            self.assertFalse(conn.in_transaction)
+            async with conn.execute("PRAGMA query_only") as cursor:
+                self.assertEqual(await cursor.fetchone(), (1,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import cycle
+
+from config import MAIN, RED, YELLOW, GREEN
+from utils import metrics
+from utils.cache import TTLCache
+
+# The drawing functions below run in the worker processes. They only take plain values, so their arguments pickle
+# and hash, and return PNG bytes. matplotlib is imported there, never in the bot's own process.
+
+BACKGROUND = "#2b2d31"  # Discord's dark theme, so the image sits flush in an embed
+TEXT = "#dbdee1"
+PALETTE = tuple(f"#{colour:06x}" for colour in (MAIN, RED, YELLOW, GREEN))
+
+
+def new_figure(width, height):
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(width, height), dpi=100, facecolor=BACKGROUND)
+    ax = fig.subplots()
+    ax.set_facecolor(BACKGROUND)
+    ax.tick_params(colors=TEXT)
+    for spine in ax.spines.values():
+        spine.set_color(TEXT)
+    return fig, ax
+
+
+def to_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def bar_chart(title, labels, hours):
+    """
+    Horizontal bars in the order given, the first on top.
+    """
+    fig, ax = new_figure(8, 1.2 + 0.3 * len(labels))
+    positions = range(len(labels))
+    ax.barh(positions, hours, color=PALETTE[0])
+    ax.set_yticks(positions)
+    ax.set_yticklabels(labels)
+    ax.invert_yaxis()
+    ax.set_xlabel("Hours", color=TEXT)
+    ax.set_title(title, color=TEXT)
+    return to_png(fig)
+
+
+def line_chart(title, x_labels, series):
+    """
+    One line per (label, hours) series, all over the same x labels.
+    """
+    fig, ax = new_figure(8, 4)
+    for (label, hours), colour in zip(series, cycle(PALETTE)):
+        ax.plot(x_labels, hours, marker="o", label=label, color=colour)
+    ax.set_ylim(bottom=0)
+    ax.set_ylabel("Hours", color=TEXT)
+    ax.set_title(title, color=TEXT)
+    if len(series) > 1:
+        ax.legend(facecolor=BACKGROUND, labelcolor=TEXT)
+    return to_png(fig)
+
+
+def hours(seconds):
+    # Charts show hours to two decimals, finer changes would only split the cache
+    return round(seconds / 3600, 2)
+
+
+class ChartRenderer:
+    """
+    Draws charts in a pool of worker processes, so plotting never holds up the event loop.
+
+    Images are cached by the drawing function and its arguments. The arguments are the chart's data, already rounded
+    to what the chart can show, so they double as its version: a flush that leaves a chart looking the same still
+    hits the cache, and any change that would show misses it. Identical requests made while a chart is being drawn
+    wait for the same render.
+    """
+
+    def __init__(self, workers, maxsize, ttl):
+        self.workers = workers
+        self.cache = TTLCache(maxsize, ttl)
+        self.pool = None
+        self.rendering = {}  # (function name, arguments) -> Future of a render in progress
+
+    async def render(self, draw, *args):
+        key = (draw.__name__, args)
+        png = self.cache.get(key)
+        if png is not None:
+            metrics.CHARTS.inc(source="cache")
+            return png
+
+        future = self.rendering.get(key)
+        if future is None:
+            metrics.CHARTS.inc(source="rendered")
+            start = time.perf_counter()
+            pool = self.get_pool()
+            try:
+                future = asyncio.get_running_loop().run_in_executor(pool, draw, *args)
+            except BrokenProcessPool:
+                # Broke since the last render finished, retry once on a fresh pool
+                self.replace_pool(pool)
+                pool = self.get_pool()
+                future = asyncio.get_running_loop().run_in_executor(pool, draw, *args)
+            self.rendering[key] = future
+            future.add_done_callback(lambda done: self.finished(key, done, start, pool))
+        # One caller giving up must not cancel the render for the others
+        return await asyncio.shield(future)
+
+    def finished(self, key, future, start, pool):
+        del self.rendering[key]
+        metrics.CHART_SECONDS.observe(time.perf_counter() - start)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.cache.set(key, future.result())
+        elif isinstance(error, BrokenProcessPool):
+            # A worker died and the pool takes no more work, the next render starts a fresh one
+            self.replace_pool(pool)
+
+    def get_pool(self):
+        if self.pool is None:
+            # Spawned rather than forked, the bot's process has database threads running
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def replace_pool(self, pool):
+        if self.pool is pool:
+            print("Chart pool broke, starting a new one")
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
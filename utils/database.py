@@ -0,0 +1,222 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import aiosqlite
+
+from utils import metrics
+from utils.migrations import migrate
+
+# Applied to every connection
+SHARED_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",  # ~16 MB page cache
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 134217728",
+)
+
+WRITER_PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",  # Only takes effect on a new file, migration 6 converts existing ones
+    "PRAGMA journal_mode = WAL",  # Readers see the last commit and never block the writer
+    "PRAGMA synchronous = NORMAL",  # Safe under WAL, skips the fsync on every commit
+    "PRAGMA foreign_keys = ON",
+)
+
+READER_PRAGMAS = (
+    "PRAGMA query_only = ON",
+)
+
+# Statement kinds DB_STATEMENT_SECONDS is labelled with, anything else is counted as "other"
+STATEMENT_KINDS = {"select", "with", "insert", "update", "delete", "replace", "pragma", "begin", "commit", "rollback"}
+
+
+@lru_cache(maxsize=512)
+def statement_kind(sql):
+    words = sql.split(None, 1)
+    kind = words[0].lower() if words else ""
+    return kind if kind in STATEMENT_KINDS else "other"
+
+
+class Statement:
+    """
+    What TimedConnection.execute returns: awaited it gives the cursor, used with async with it also closes it, like
+    aiosqlite's own.
+    """
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.cursor = None
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    async def __aenter__(self):
+        self.cursor = await self.coro
+        return self.cursor
+
+    async def __aexit__(self, *exc_info):
+        await self.cursor.close()
+
+
+class TimedCursor:
+    """
+    An aiosqlite cursor whose fetches are timed into DB_STATEMENT_SECONDS.
+    """
+
+    def __init__(self, cursor, kind):
+        self.cursor = cursor
+        self.kind = kind
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    async def fetchone(self):
+        with metrics.DB_STATEMENT_SECONDS.time(statement=self.kind, step="fetch"):
+            return await self.cursor.fetchone()
+
+    async def fetchmany(self, size=None):
+        with metrics.DB_STATEMENT_SECONDS.time(statement=self.kind, step="fetch"):
+            return await self.cursor.fetchmany(size)
+
+    async def fetchall(self):
+        with metrics.DB_STATEMENT_SECONDS.time(statement=self.kind, step="fetch"):
+            return await self.cursor.fetchall()
+
+    async def __aiter__(self):
+        while True:
+            rows = await self.fetchmany(self.cursor.arraysize)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+
+class TimedConnection:
+    """
+    An aiosqlite connection whose statements are timed one by one into DB_STATEMENT_SECONDS, by kind of statement
+    and by step: execute (preparing it and running it to its first row) or fetch. Everything else is passed through.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def execute(self, sql, parameters=None):
+        return Statement(self.timed_execute(sql, parameters))
+
+    async def timed_execute(self, sql, parameters):
+        kind = statement_kind(sql)
+        with metrics.DB_STATEMENT_SECONDS.time(statement=kind, step="execute"):
+            cursor = await self.conn.execute(sql, parameters)
+        return TimedCursor(cursor, kind)
+
+    async def executemany(self, sql, parameters):
+        with metrics.DB_STATEMENT_SECONDS.time(statement=statement_kind(sql), step="execute"):
+            return await self.conn.executemany(sql, parameters)
+
+    async def executescript(self, sql):
+        with metrics.DB_STATEMENT_SECONDS.time(statement=statement_kind(sql), step="execute"):
+            return await self.conn.executescript(sql)
+
+
+class Database:
+    """
+    Long-lived connections to the stats database, opened once when the bot starts.
+
+    All writes go through a single writer connection, serialised by a lock. Reads borrow one of a small
+    pool of read-only connections, so leaderboard queries never wait on the voice listener.
+    """
+
+    def __init__(self, path, readers=3):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._write_lock = None
+        self._pool = None
+        self._connections = []
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def open(self):
+        if self.is_open:
+            return
+
+        self._write_lock = asyncio.Lock()
+        self._pool = asyncio.Queue()
+
+        # The writer is opened first so the database is in WAL mode before any reader attaches
+        self._writer = await self._connect(self.path, SHARED_PRAGMAS + WRITER_PRAGMAS)
+        await migrate(self._writer)
+        for _ in range(self.readers):
+            reader = await self._connect(f"file:{self.path}?mode=ro", SHARED_PRAGMAS + READER_PRAGMAS, uri=True)
+            self._pool.put_nowait(reader)
+
+    async def _connect(self, database, pragmas, **kwargs):
+        # isolation_level=None leaves transaction control to transaction(). The repository's statements are constant
+        # text, so a larger statement cache keeps all of them prepared.
+        conn = await aiosqlite.connect(database, isolation_level=None, cached_statements=256, **kwargs)
+        self._connections.append(conn)
+        for pragma in pragmas:
+            await conn.execute(pragma)
+        return TimedConnection(conn)
+
+    async def close(self):
+        if not self.is_open:
+            return
+
+        # Wait for an in-flight write to finish before tearing the writer down
+        async with self._write_lock:
+            await self._writer.execute("PRAGMA optimize")
+            for conn in self._connections:
+                await conn.close()
+            self._connections = []
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        """
+        Borrows a read-only connection from the pool.
+        """
+        with metrics.DB_READ_WAIT_SECONDS.time():
+            conn = await self._pool.get()
+        try:
+            with metrics.DB_READ_SECONDS.time():
+                yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Yields the writer connection inside a single IMMEDIATE transaction, committed on exit and rolled back if
+        the block raises.
+        """
+        waited = time.perf_counter()
+        async with self._write_lock:
+            start = time.perf_counter()
+            metrics.DB_LOCK_WAIT_SECONDS.observe(start - waited)
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.execute("ROLLBACK")
+                metrics.DB_ROLLBACKS.inc()
+                metrics.DB_TRANSACTION_SECONDS.observe(time.perf_counter() - start)
+                raise
+            await self._writer.execute("COMMIT")
+            metrics.DB_COMMITS.inc()
+            metrics.DB_TRANSACTION_SECONDS.observe(time.perf_counter() - start)
+
+    async def incremental_vacuum(self):
+        """
+        Returns the database's free pages to the filesystem. Needs auto_vacuum = INCREMENTAL, otherwise it does nothing.
+        """
+        async with self._write_lock:
+            # Each step of the pragma frees a single page. Fetching its rows stops after the first step on newer
+            # Pythons' sqlite3, executescript always runs it to completion.
+            await self._writer.executescript("PRAGMA incremental_vacuum;")
@@ -0,0 +1,151 @@
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
+FORMATS = ("csv", "jsonl")
+BATCH_SIZE = 500  # Rows pulled per fetchmany
+PROGRESS_STEPS = 10000  # SQLite VM instructions between deadline checks
+
+# What an ad hoc query may do: read tables, call functions and run (recursive) SELECTs. Writes, PRAGMA, BEGIN,
+# ATTACH and the like are refused when the statement is prepared, so are table-valued functions such as json_each
+# and pragma_table_info, whose tables are declared through the schema.
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# Every stats table, in the order a dump writes them
+STATS_TABLES = ("TrackedChannels", "AllTimeStats", "MonthlyStats", "DailyStats", "VoiceSessions", "ChannelOccupancy",
+                "MemberTotals")
+
+
+class ExportResult(NamedTuple):
+    buffer: io.BytesIO
+    rows: int
+    truncated: bool  # Rows were left out because of the row cap
+
+    @property
+    def size(self):
+        return self.buffer.getbuffer().nbytes
+
+
+@asynccontextmanager
+async def deadline(conn, seconds):
+    """
+    Aborts any statement on conn still running after the given number of seconds, it fails with
+    sqlite3.OperationalError("interrupted"). None means no limit.
+    """
+    if seconds is None:
+        yield
+        return
+
+    expires = time.monotonic() + seconds
+    await conn.set_progress_handler(lambda: time.monotonic() > expires, PROGRESS_STEPS)
+    try:
+        yield
+    finally:
+        # The connection goes back to the pool, so the handler must not outlive this export
+        await conn.set_progress_handler(None, 0)
+
+
+def authorize_read(action, *args):
+    return sqlite3.SQLITE_OK if action in READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def authorize_all(action, *args):
+    return sqlite3.SQLITE_OK
+
+
+@asynccontextmanager
+async def read_only(conn):
+    """
+    Only lets read-only statements be prepared on conn, they fail with sqlite3.DatabaseError("not authorized").
+    The connection is left as it was found, with no transaction open.
+    """
+    # Setting an authorizer expires the connection's prepared statements, so cached ones are checked again too
+    await conn.set_authorizer(authorize_read)
+    try:
+        yield
+    finally:
+        # Before Python 3.11 set_authorizer(None) installs None as the callback, which then denies everything, so the
+        # authorizer is swapped for one that allows everything instead. It only runs when a statement is prepared.
+        await conn.set_authorizer(authorize_all)
+        if conn.in_transaction:
+            await conn.execute("ROLLBACK")
+
+
+def plain_value(value):
+    # Blobs are written as hex, in both formats
+    return value.hex() if isinstance(value, bytes) else value
+
+
+async def export_cursor(cursor, fmt, max_rows=None, compress=False):
+    """
+    Streams a cursor's rows into an in-memory CSV or JSON Lines file, optionally gzipped. Stops after max_rows.
+    """
+    buffer = io.BytesIO()
+    raw = gzip.GzipFile(fileobj=buffer, mode="wb") if compress else buffer
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    columns = [column[0] for column in cursor.description or ()]
+    if fmt == "csv":
+        writer = csv.writer(text)
+        writer.writerow(columns)
+
+        def write(row):
+            writer.writerow([plain_value(value) for value in row])
+    else:
+        def write(row):
+            text.write(json.dumps(dict(zip(columns, map(plain_value, row))), default=str) + "\n")
+
+    rows = 0
+    truncated = False
+    while True:
+        batch = await cursor.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        if max_rows is not None and rows + len(batch) > max_rows:
+            batch = batch[:max_rows - rows]
+            truncated = True
+        for row in batch:
+            write(row)
+        rows += len(batch)
+        if truncated:
+            break
+
+    text.flush()
+    text.detach()
+    if compress:
+        raw.close()
+    buffer.seek(0)
+    return ExportResult(buffer, rows, truncated)
+
+
+async def export_query(conn, sql, params=(), fmt="csv", max_rows=None, timeout=None):
+    """
+    Runs one read-only query and streams its rows into an ExportResult. The connection usually belongs to the read
+    pool, so anything that would change it for later users is refused.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    async with read_only(conn), deadline(conn, timeout):
+        async with conn.execute(sql, params) as cursor:
+            return await export_cursor(cursor, fmt, max_rows)
+
+
+async def export_tables(conn, tables, fmt="csv", timeout=None):
+    """
+    Dumps whole tables as gzipped files, all read inside one transaction so they come from the same snapshot.
+    Returns {table: ExportResult}.
+    """
+    results = {}
+    async with deadline(conn, timeout):
+        await conn.execute("BEGIN")
+        try:
+            for table in tables:
+                async with conn.execute(f"SELECT * FROM {table}") as cursor:
+                    results[table] = await export_cursor(cursor, fmt, compress=True)
+        finally:
+            await conn.execute("COMMIT")
+    return results
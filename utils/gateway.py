@@ -0,0 +1,28 @@
+import discord
+
+
+def gateway_options(lean):
+    """
+    Returns the intents and cache settings to build the bot with.
+
+    The lean set only subscribes to what the cogs use: guilds (channels and roles), voice states, messages for
+    prefix commands, and members so role rosters and names can be fetched on demand. A member is cached once a voice
+    state update or a command of theirs arrives, no one is cached at startup (not even those already in voice, whom
+    GUILD_CREATE only lists), guilds are not chunked and no messages are kept.
+    """
+    if not lean:
+        return {"intents": discord.Intents.all()}
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.members = True
+    intents.voice_states = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags(voice=True, joined=False, interaction=True),
+        "chunk_guilds_at_startup": False,
+        "max_messages": None,
+    }
@@ -0,0 +1,199 @@
+from discord.ext import pages
+
+from utils.statsRepository import page_key
+
+
+class Section:
+    """
+    One leaderboard within a paginator, e.g. a single month, over a StatsRepository Totals query.
+    """
+
+    def __init__(self, name, totals):
+        self.name = name
+        self.totals = totals
+        self.stored = totals._replace(live=())  # The same query, without the members who have unwritten time
+        self.live = []  # Their MemberTotal rows above the minimum, highest first
+        self.stored_rows = 0
+        self.rows = 0
+
+    def page_count(self, page_size):
+        return max(1, -(-self.rows // page_size))
+
+
+class LeaderboardPages:
+    """
+    A lazily loaded page sequence for LazyPaginator. Only the page on screen is held, along with the stored rows it
+    was built from, whose first and last keys are all that is needed to seek to its neighbours, so page N costs the
+    same as page 1.
+
+    render is a coroutine called as render(section, rows, page_number) with the page's MemberTotal rows, returning
+    a pages.Page. Members below minimum seconds are left out. Pages of stored rows and the row counts are kept in
+    cache (a TTLCache) under cache_key, the few members with live time are merged into them on every read.
+    Rendered pages are cached too, for sections without live time.
+    """
+
+    def __init__(self, stats, sections, page_size, render, minimum=0, cache=None, cache_key=None):
+        self.stats = stats
+        self.sections = sections
+        self.page_size = page_size
+        self.minimum = minimum
+        self.render = render
+        self.cache = cache
+        if cache_key is not None:
+            # The stored queries leave out whoever had live time, so their rows hold only for that same set
+            live_ids = tuple(tuple(sorted(row.user_id for row in section.totals.live)) for section in sections)
+            cache_key = (*cache_key, live_ids)
+        self.cache_key = cache_key
+
+        self.index = None
+        self.page = None
+        self.loaded = {}  # (section number, stored page number) -> MemberTotal rows behind the page on screen
+
+    async def open(self):
+        """
+        Counts the rows in each section and loads the first page.
+        """
+        counts = self._cache_get("rows")
+        if counts is None:
+            generation = self.cache.generation if self.cache is not None else None
+            counts = [await self.stats.count_totals(section.stored, self.minimum) for section in self.sections]
+            self._cache_set("rows", counts, generation)
+
+        for section, stored_rows in zip(self.sections, counts):
+            section.live = sorted((row for row in section.totals.live if row.seconds >= self.minimum), key=page_key)
+            section.stored_rows = stored_rows
+            section.rows = stored_rows + len(section.live)
+        await self.load(0)
+        return self
+
+    def __len__(self):
+        return sum(section.page_count(self.page_size) for section in self.sections)
+
+    def __getitem__(self, index):
+        if index != self.index:
+            raise IndexError(f"page {index} has not been loaded")
+        return self.page
+
+    def __iter__(self):
+        # The paginator only iterates to check for page groups, so the page on screen is enough
+        yield self.page
+
+    def locate(self, index):
+        """
+        Maps a paginator page index to (section, page number within that section).
+        """
+        for section in self.sections:
+            count = section.page_count(self.page_size)
+            if index < count:
+                return section, index
+            index -= count
+        raise IndexError(index)
+
+    async def load(self, index):
+        if index == self.index:
+            return
+
+        section, number = self.locate(index)
+        page = self._cache_get(("page", index)) if not section.live else None
+        if page is None:
+            generation = self.cache.generation if self.cache is not None else None
+            rows = await self.fetch(section, number)
+            page = await self.render(section, rows, number)
+            if not section.live:
+                self._cache_set(("page", index), page, generation)
+
+        self.index = index
+        self.page = page
+
+    async def fetch(self, section, number):
+        """
+        Returns the rows of a page: the stored rows it can hold, with the live rows merged in at their places.
+        """
+        start = number * self.page_size
+        live = section.live
+        # At most every live row ranks above the page, pushing its stored rows down by that many
+        first = max(0, start - len(live))
+        stored = await self.stored_range(section, first, min(section.stored_rows, start + self.page_size))
+        if first == 0:
+            merged, position = sorted(stored + live, key=page_key), 0
+        else:
+            ahead = sum(1 for row in live if page_key(row) < page_key(stored[0]))
+            merged, position = sorted(stored + live[ahead:], key=page_key), first + ahead
+        return merged[start - position:start - position + self.page_size]
+
+    async def stored_range(self, section, first, end):
+        """
+        Returns the stored rows from position first up to end, from whole stored pages.
+        """
+        size = self.page_size
+        number = self.sections.index(section)
+        loaded = {}
+        for page in range(first // size, (end - 1) // size + 1):
+            loaded[page] = await self.stored_page(section, number, page, loaded)
+        self.loaded = {(number, page): rows for page, rows in loaded.items()}
+
+        rows = [row for page in sorted(loaded) for row in loaded[page]]
+        skip = first - first // size * size
+        return rows[skip:skip + end - first]
+
+    async def stored_page(self, section, number, page, loaded):
+        rows = self._cache_get(("stored", number, page))
+        if rows is not None:
+            return rows
+
+        generation = self.cache.generation if self.cache is not None else None
+        size = self.page_size
+        previous = self.known(number, page - 1, loaded)
+        following = self.known(number, page + 1, loaded)
+        if page == 0:
+            options = {}
+        elif page == -(-section.stored_rows // size) - 1:
+            options = {"last": True}
+            size = section.stored_rows - page * size
+        elif previous:
+            options = {"after": (previous[-1].seconds, previous[-1].user_id)}
+        elif following:
+            options = {"before": (following[0].seconds, following[0].user_id)}
+        else:
+            options = {"offset": page * size}
+        rows = await self.stats.totals_page(section.stored, size, self.minimum, **options)
+        self._cache_set(("stored", number, page), rows, generation)
+        return rows
+
+    def known(self, number, page, loaded):
+        """
+        Returns a stored page that is already at hand, or None.
+        """
+        rows = loaded.get(page, self.loaded.get((number, page)))
+        return rows if rows is not None else self._cache_get(("stored", number, page))
+
+    def _cache_get(self, part):
+        if self.cache is None:
+            return None
+        return self.cache.get((*self.cache_key, part))
+
+    def _cache_set(self, part, value, generation):
+        if self.cache is not None:
+            self.cache.set((*self.cache_key, part), value, generation)
+
+
+class LazyPaginator(pages.Paginator):
+    """
+    A paginator over LeaderboardPages that fetches and renders each page when it is navigated to.
+    """
+
+    def __init__(self, source, **kwargs):
+        super().__init__(pages=source, **kwargs)
+        self.source = source
+
+    async def goto_page(self, page_number=0, *, interaction=None):
+        # A cold page can take longer to load than the three seconds Discord gives a button press, so it is
+        # acknowledged first. The message is then edited through the paginator's own reference to it.
+        if interaction is not None and not interaction.response.is_done():
+            await interaction.response.defer()
+        await self.source.load(page_number)
+        await super().goto_page(page_number)
+
+    async def respond(self, interaction, *args, **kwargs):
+        await self.source.load(self.current_page)
+        return await super().respond(interaction, *args, **kwargs)
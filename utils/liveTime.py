@@ -0,0 +1,75 @@
+from itertools import chain
+
+from utils.statsRepository import ALL_CHANNELS
+from utils.utils import month_key, week_start
+from utils.writeBuffer import split_by_day
+
+
+def in_period(kind, period, day):
+    if kind == "week":
+        return week_start(day).isoformat() == period
+    if kind == "month":
+        return month_key(day) == period
+    return True
+
+
+class LiveTime:
+    """
+    Voice time the database does not hold yet: sessions still open, sessions held over a leave in case of a quick
+    rejoin, and finished sessions waiting in the write buffer or in a flush that has not committed. StatsRepository
+    adds it to the stored totals when it is attached, so reads are current to the second without any extra writes.
+
+    Looking up one member is a dict lookup plus a pass over the buffer, a whole guild is one pass over the open and
+    buffered sessions.
+    """
+
+    def __init__(self, sessions, buffer):
+        self.sessions = sessions  # The bot's SessionTracker
+        self.buffer = buffer
+
+    @property
+    def generation(self):
+        return self.buffer.generation
+
+    async def settled(self):
+        """
+        Waits for a flush in progress to finish, then returns the buffer's flush generation. A read that sees the
+        same generation after it is done did not overlap a flush.
+        """
+        while self.buffer.generation % 2:
+            async with self.buffer.flushing:
+                pass
+        return self.buffer.generation
+
+    def pieces(self, guild_id, user_id=None):
+        """
+        Yields (user ID, channel ID, day, seconds) for every unwritten session in a guild, or of one member, split
+        at UTC midnight.
+        """
+        buffered = ((user, channel_id, started_at, ended_at)
+                    for guild, user, channel_id, started_at, ended_at in self.buffer.unwritten()
+                    if guild == guild_id and (user_id is None or user == user_id))
+
+        for user, channel_id, started_at, ended_at in chain(self.sessions.spans(guild_id, user_id), buffered):
+            for day, seconds in split_by_day(started_at, ended_at):
+                yield user, channel_id, day, seconds
+
+    def member(self, kind, period, guild_id, user_id):
+        """
+        Returns {ChannelID: seconds} of unwritten time for one member in one window, e.g. ("week", "2024-05-06").
+        """
+        channels = {}
+        for _, channel_id, day, seconds in self.pieces(guild_id, user_id):
+            if in_period(kind, period, day):
+                channels[channel_id] = channels.get(channel_id, 0) + seconds
+        return channels
+
+    def board(self, kind, period, guild_id, channel_id=ALL_CHANNELS):
+        """
+        Returns {UserID: seconds} of unwritten time for everyone on one leaderboard.
+        """
+        members = {}
+        for user_id, piece_channel, day, seconds in self.pieces(guild_id):
+            if (channel_id == ALL_CHANNELS or piece_channel == channel_id) and in_period(kind, period, day):
+                members[user_id] = members.get(user_id, 0) + seconds
+        return members
@@ -0,0 +1,56 @@
+from utils.cache import TTLCache
+
+
+class MemberDirectory:
+    """
+    Role rosters and display names that work whether or not the guild's members are cached.
+
+    When the guild was chunked at startup the member cache is complete and is used directly. In lean gateway mode
+    it only holds members in voice, so a guild's roster (just the role IDs of each member) is downloaded once and
+    kept for ttl seconds, and names missing from the cache are looked up by ID.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.rosters = TTLCache(maxsize, ttl)  # GuildID -> {RoleID: [UserID, ...]}
+
+    async def role_member_ids(self, role):
+        guild = role.guild
+        if guild.chunked:
+            return [member.id for member in role.members]
+        roster = await self.roster(guild)
+        return roster.get(role.id, [])
+
+    async def roster(self, guild):
+        roster = self.rosters.get(guild.id)
+        if roster is None:
+            members = await guild.chunk(cache=False)
+            if members is None:
+                # The guild has left the cache, the bot was removed from it or it went unavailable
+                return {}
+            roster = {}
+            for member in members:
+                for member_role in member.roles:
+                    roster.setdefault(member_role.id, []).append(member.id)
+            self.rosters.set(guild.id, roster)
+        return roster
+
+    async def display_names(self, guild, user_ids):
+        """
+        Returns {UserID: display name} for the given members, falling back to the ID for anyone who has left.
+        """
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is not None:
+                names[user_id] = member.display_name
+            else:
+                missing.append(user_id)
+
+        # One gateway request covers up to 100 members, more than a leaderboard page holds
+        for start in range(0, len(missing), 100):
+            batch = missing[start:start + 100]
+            for member in await guild.query_members(user_ids=batch, limit=len(batch), cache=False):
+                names[member.id] = member.display_name
+
+        return {user_id: names.get(user_id, str(user_id)) for user_id in user_ids}
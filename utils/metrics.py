@@ -0,0 +1,190 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Every metric family, in the order they are rendered
+REGISTRY = []
+
+# Upper bounds in seconds, from half a millisecond (a cached read) to ten seconds (a stuck flush)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def label_key(labels):
+    # Hot paths pass no labels or a single one, neither of which needs sorting
+    if len(labels) < 2:
+        return tuple(labels.items())
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """
+    A count that only goes up, optionally split by labels.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}  # label key -> count
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        return [f"{self.name}{format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge:
+    """
+    A value that goes up and down. Either set directly or read from a function when rendered.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.function = None
+        REGISTRY.append(self)
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def render(self):
+        return [f"{self.name} {self.get()}"]
+
+
+class HistogramSeries:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        """
+        Estimates a quantile by interpolating within the bucket it falls in, as Prometheus' histogram_quantile does.
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Histogram:
+    """
+    Observations (usually durations in seconds) counted into fixed buckets, optionally split by labels.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}  # label key -> HistogramSeries
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        key = label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = HistogramSeries(self.buckets)
+        return series
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(key, (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {series.sum}")
+            lines.append(f"{self.name}_count{format_labels(key)} {series.count}")
+        return lines
+
+
+def render():
+    """
+    Renders every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Voice listener
+VOICE_EVENTS = Counter("skirabot_voice_events_total",
+                       "Tracked voice state changes, by kind (join, leave, hop, rejoin).")
+VOICE_EVENT_SECONDS = Histogram("skirabot_voice_event_seconds", "Time spent handling a voice state update.")
+OPEN_SESSIONS = Gauge("skirabot_voice_open_sessions", "Voice sessions currently in progress.")
+BUFFER_DEPTH = Gauge("skirabot_voice_buffer_depth", "Finished sessions waiting for the next flush.")
+FLUSH_SECONDS = Histogram("skirabot_voice_flush_seconds", "Time taken by each voice buffer flush.")
+SESSIONS_WRITTEN = Counter("skirabot_voice_sessions_written_total", "Voice sessions written to the database.")
+ROWS_WRITTEN = Counter("skirabot_db_rows_written_total", "Session and rollup rows written by voice flushes.")
+
+# Database
+DB_READ_WAIT_SECONDS = Histogram("skirabot_db_read_wait_seconds", "Time spent waiting for a pooled read connection.")
+DB_READ_SECONDS = Histogram("skirabot_db_read_seconds", "Time a read connection was held.")
+DB_STATEMENT_SECONDS = Histogram("skirabot_db_statement_seconds",
+                                 "Time spent in each statement, by kind of statement and step (execute or fetch).")
+DB_LOCK_WAIT_SECONDS = Histogram("skirabot_db_lock_wait_seconds", "Time spent waiting for the write lock.")
+DB_TRANSACTION_SECONDS = Histogram("skirabot_db_transaction_seconds", "Time from BEGIN to COMMIT or ROLLBACK.")
+DB_COMMITS = Counter("skirabot_db_commits_total", "Write transactions committed.")
+DB_ROLLBACKS = Counter("skirabot_db_rollbacks_total", "Write transactions rolled back.")
+
+# Commands
+COMMANDS = Counter("skirabot_commands_total", "Commands run, by command and outcome.")
+COMMAND_SECONDS = Histogram("skirabot_command_seconds", "Time from a command being invoked to it finishing.")
+
+# Event loop
+LOOP_LAG_SECONDS = Histogram("skirabot_event_loop_lag_seconds", "How late the event loop woke a sleeping task.")
+LOOP_LAG = Gauge("skirabot_event_loop_lag_last_seconds", "The most recent event loop lag sample.")
+
+# Charts
+CHARTS = Counter("skirabot_charts_total", "Charts requested, by source (cache or rendered).")
+CHART_SECONDS = Histogram("skirabot_chart_render_seconds", "Time a chart took to come back from a render worker.")
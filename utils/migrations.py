@@ -0,0 +1,387 @@
+from config import GUILD_ID, TRACK_CHANNEL
+
+
+async def enable_incremental_vacuum(db):
+    # auto_vacuum only changes on an existing file when it is rebuilt, and VACUUM cannot run inside a transaction
+    await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    await db.execute("VACUUM")
+
+
+async def reclaim_free_pages(db):
+    # Fetching the pragma's rows can stop after the first page it frees, executescript frees them all
+    await db.executescript("PRAGMA incremental_vacuum;")
+
+
+# Each migration runs once, in order, inside its own transaction. A migration given as a coroutine function instead
+# of a script runs outside any transaction, for statements like VACUUM, so it must be safe to repeat if interrupted.
+# The schema version is kept in PRAGMA user_version. Never edit a migration that has shipped, add a new one instead.
+MIGRATIONS = [
+    (1, "Composite keys and indexes for the stats tables", """
+        -- Leftovers from editing the database by hand, and LastUpdated which the Rollovers ledger replaces
+        DROP TABLE IF EXISTS sqlb_temp_table_2;
+        DROP TABLE IF EXISTS MontlyStats;
+        DROP TABLE IF EXISTS LastUpdated;
+
+        -- Original table shapes, so a brand new database file migrates the same way as the old one
+        CREATE TABLE IF NOT EXISTS WeeklyStats (UserID INTEGER, ChannelID INTEGER, TimeSpent REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS MonthlyStats (UserID INTEGER, ChannelID INTEGER, TimeSpent REAL NOT NULL,
+                                                 Month INTEGER);
+        CREATE TABLE IF NOT EXISTS AllTimeStats (UserID INTEGER, ChannelID INTEGER, TimeSpent REAL NOT NULL);
+
+        CREATE TABLE IF NOT EXISTS Rollovers (
+            Kind TEXT NOT NULL,
+            Period TEXT NOT NULL,
+            CompletedAt TEXT NOT NULL,
+            PRIMARY KEY (Kind, Period)
+        );
+
+        -- Rebuild each stats table with a composite key, merging any duplicate rows into one
+        CREATE TABLE WeeklyStats_new (
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (UserID, ChannelID)
+        );
+        INSERT INTO WeeklyStats_new (UserID, ChannelID, TimeSpent)
+        SELECT UserID, ChannelID, SUM(TimeSpent) FROM WeeklyStats
+        WHERE UserID IS NOT NULL AND ChannelID IS NOT NULL
+        GROUP BY UserID, ChannelID;
+        DROP TABLE WeeklyStats;
+        ALTER TABLE WeeklyStats_new RENAME TO WeeklyStats;
+
+        CREATE TABLE MonthlyStats_new (
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            Month INTEGER NOT NULL,
+            PRIMARY KEY (UserID, ChannelID, Month)
+        );
+        INSERT INTO MonthlyStats_new (UserID, ChannelID, TimeSpent, Month)
+        SELECT UserID, ChannelID, SUM(TimeSpent), COALESCE(Month, CAST(strftime('%m', 'now') AS INTEGER))
+        FROM MonthlyStats
+        WHERE UserID IS NOT NULL AND ChannelID IS NOT NULL
+        GROUP BY UserID, ChannelID, COALESCE(Month, CAST(strftime('%m', 'now') AS INTEGER));
+        DROP TABLE MonthlyStats;
+        ALTER TABLE MonthlyStats_new RENAME TO MonthlyStats;
+
+        CREATE TABLE AllTimeStats_new (
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (UserID, ChannelID)
+        );
+        INSERT INTO AllTimeStats_new (UserID, ChannelID, TimeSpent)
+        SELECT UserID, ChannelID, SUM(TimeSpent) FROM AllTimeStats
+        WHERE UserID IS NOT NULL AND ChannelID IS NOT NULL
+        GROUP BY UserID, ChannelID;
+        DROP TABLE AllTimeStats;
+        ALTER TABLE AllTimeStats_new RENAME TO AllTimeStats;
+
+        -- Covers the per-month leaderboards without touching the table
+        CREATE INDEX MonthlyStats_Month ON MonthlyStats (Month, UserID, TimeSpent);
+    """),
+    (2, "Append-only session log and daily rollups", """
+        CREATE TABLE VoiceSessions (
+            SessionID INTEGER PRIMARY KEY,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            StartedAt REAL NOT NULL,
+            EndedAt REAL NOT NULL
+        );
+        CREATE INDEX VoiceSessions_User ON VoiceSessions (UserID, StartedAt);
+
+        CREATE TABLE DailyStats (
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            Day TEXT NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (UserID, ChannelID, Day)
+        );
+        CREATE INDEX DailyStats_Day ON DailyStats (Day, UserID, TimeSpent);
+
+        -- MonthlyStats and AllTimeStats are now kept current on every flush, so WeeklyStats is no longer needed.
+        -- Time it holds that has not been rolled over yet is credited to today.
+        INSERT INTO DailyStats (UserID, ChannelID, Day, TimeSpent)
+        SELECT UserID, ChannelID, date('now'), TimeSpent FROM WeeklyStats;
+        INSERT INTO MonthlyStats (UserID, ChannelID, TimeSpent, Month)
+        SELECT UserID, ChannelID, TimeSpent, CAST(strftime('%m', 'now') AS INTEGER) FROM WeeklyStats WHERE true
+        ON CONFLICT (UserID, ChannelID, Month) DO UPDATE SET TimeSpent = TimeSpent + excluded.TimeSpent;
+        INSERT INTO AllTimeStats (UserID, ChannelID, TimeSpent)
+        SELECT UserID, ChannelID, TimeSpent FROM WeeklyStats WHERE true
+        ON CONFLICT (UserID, ChannelID) DO UPDATE SET TimeSpent = TimeSpent + excluded.TimeSpent;
+        DROP TABLE WeeklyStats;
+    """),
+    (3, "Checkpoint for sessions still in progress", """
+        CREATE TABLE OpenSessions (
+            UserID INTEGER PRIMARY KEY,
+            ChannelID INTEGER NOT NULL,
+            StartedAt REAL NOT NULL
+        );
+
+        CREATE TABLE BotState (
+            Key TEXT PRIMARY KEY,
+            Value
+        );
+    """),
+    # Everything recorded before this point came from the single guild in config.py, and its tracked channels
+    # become that guild's initial TrackedChannels rows.
+    (4, "Guild dimension and per-guild tracked channels", f"""
+        CREATE TABLE TrackedChannels (
+            GuildID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            PRIMARY KEY (GuildID, ChannelID)
+        );
+        INSERT INTO TrackedChannels (GuildID, ChannelID)
+        SELECT {GUILD_ID}, value FROM json_each('{list(TRACK_CHANNEL)}');
+
+        CREATE TABLE VoiceSessions_new (
+            SessionID INTEGER PRIMARY KEY,
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            StartedAt REAL NOT NULL,
+            EndedAt REAL NOT NULL
+        );
+        INSERT INTO VoiceSessions_new (SessionID, GuildID, UserID, ChannelID, StartedAt, EndedAt)
+        SELECT SessionID, {GUILD_ID}, UserID, ChannelID, StartedAt, EndedAt FROM VoiceSessions;
+        DROP TABLE VoiceSessions;
+        ALTER TABLE VoiceSessions_new RENAME TO VoiceSessions;
+        CREATE INDEX VoiceSessions_User ON VoiceSessions (GuildID, UserID, StartedAt);
+
+        CREATE TABLE DailyStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            Day TEXT NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (GuildID, UserID, ChannelID, Day)
+        );
+        INSERT INTO DailyStats_new (GuildID, UserID, ChannelID, Day, TimeSpent)
+        SELECT {GUILD_ID}, UserID, ChannelID, Day, TimeSpent FROM DailyStats;
+        DROP TABLE DailyStats;
+        ALTER TABLE DailyStats_new RENAME TO DailyStats;
+        CREATE INDEX DailyStats_Day ON DailyStats (GuildID, Day, UserID, TimeSpent);
+
+        CREATE TABLE MonthlyStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            Month INTEGER NOT NULL,
+            PRIMARY KEY (GuildID, UserID, ChannelID, Month)
+        );
+        INSERT INTO MonthlyStats_new (GuildID, UserID, ChannelID, TimeSpent, Month)
+        SELECT {GUILD_ID}, UserID, ChannelID, TimeSpent, Month FROM MonthlyStats;
+        DROP TABLE MonthlyStats;
+        ALTER TABLE MonthlyStats_new RENAME TO MonthlyStats;
+        CREATE INDEX MonthlyStats_Month ON MonthlyStats (GuildID, Month, UserID, TimeSpent);
+
+        CREATE TABLE AllTimeStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (GuildID, UserID, ChannelID)
+        );
+        INSERT INTO AllTimeStats_new (GuildID, UserID, ChannelID, TimeSpent)
+        SELECT {GUILD_ID}, UserID, ChannelID, TimeSpent FROM AllTimeStats;
+        DROP TABLE AllTimeStats;
+        ALTER TABLE AllTimeStats_new RENAME TO AllTimeStats;
+
+        -- A member can sit in one voice channel per guild, so one open session per guild
+        CREATE TABLE OpenSessions_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            StartedAt REAL NOT NULL,
+            PRIMARY KEY (GuildID, UserID)
+        );
+        INSERT INTO OpenSessions_new (GuildID, UserID, ChannelID, StartedAt)
+        SELECT {GUILD_ID}, UserID, ChannelID, StartedAt FROM OpenSessions;
+        DROP TABLE OpenSessions;
+        ALTER TABLE OpenSessions_new RENAME TO OpenSessions;
+    """),
+    # Month numbers are assumed to be the most recent month with that number, which holds while only three months
+    # are kept. The partition key now leads both period indexes so retention deletes are range scans.
+    (5, "Year-month keys for MonthlyStats", """
+        CREATE TABLE MonthlyStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            Month TEXT NOT NULL,
+            PRIMARY KEY (GuildID, UserID, ChannelID, Month)
+        );
+        INSERT INTO MonthlyStats_new (GuildID, UserID, ChannelID, TimeSpent, Month)
+        SELECT GuildID, UserID, ChannelID, TimeSpent,
+               printf('%04d-%02d',
+                      CAST(strftime('%Y', 'now') AS INTEGER)
+                          - (Month > CAST(strftime('%m', 'now') AS INTEGER) OR Month < 1),
+                      CASE WHEN Month < 1 THEN 12 ELSE Month END)
+        FROM MonthlyStats WHERE Month <= 12;
+        DROP TABLE MonthlyStats;
+        ALTER TABLE MonthlyStats_new RENAME TO MonthlyStats;
+        CREATE INDEX MonthlyStats_Month ON MonthlyStats (Month, GuildID, UserID, TimeSpent);
+
+        DROP INDEX DailyStats_Day;
+        CREATE INDEX DailyStats_Day ON DailyStats (Day, GuildID, UserID, TimeSpent);
+    """),
+    (6, "Incremental auto-vacuum", enable_incremental_vacuum),
+    # Person-seconds are rebuilt from the session log, split at hour boundaries. Peaks were never recorded, so they
+    # start counting from here.
+    (7, "Hour-of-week channel occupancy", """
+        CREATE TABLE ChannelOccupancy (
+            GuildID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            HourOfWeek INTEGER NOT NULL,
+            PersonSeconds REAL NOT NULL DEFAULT 0,
+            PeakUsers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (GuildID, ChannelID, HourOfWeek)
+        );
+        WITH RECURSIVE Pieces (GuildID, ChannelID, StartedAt, EndedAt) AS (
+            SELECT GuildID, ChannelID, StartedAt, EndedAt FROM VoiceSessions WHERE EndedAt > StartedAt
+            UNION ALL
+            SELECT GuildID, ChannelID, (CAST(StartedAt / 3600 AS INTEGER) + 1) * 3600, EndedAt FROM Pieces
+            WHERE (CAST(StartedAt / 3600 AS INTEGER) + 1) * 3600 < EndedAt
+        )
+        INSERT INTO ChannelOccupancy (GuildID, ChannelID, HourOfWeek, PersonSeconds)
+        SELECT GuildID, ChannelID, (CAST(StartedAt / 3600 AS INTEGER) + 72) % 168,
+               ROUND(SUM(MIN(EndedAt, (CAST(StartedAt / 3600 AS INTEGER) + 1) * 3600) - StartedAt), 2)
+        FROM Pieces
+        GROUP BY 1, 2, 3;
+    """),
+    # One row per member per leaderboard (window, period and channel, 0 for all channels combined), so a ranked
+    # board or a member's rank is an ordered walk or a range count on MemberTotals_Rank
+    (8, "Ranked member totals", """
+        CREATE TABLE MemberTotals (
+            Kind TEXT NOT NULL,
+            Period TEXT NOT NULL,
+            GuildID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            TimeSpent REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (Kind, Period, GuildID, ChannelID, UserID)
+        );
+        INSERT INTO MemberTotals (Kind, Period, GuildID, ChannelID, UserID, TimeSpent)
+        SELECT 'alltime', '', GuildID, ChannelID, UserID, TimeSpent FROM AllTimeStats
+        UNION ALL
+        SELECT 'month', Month, GuildID, ChannelID, UserID, TimeSpent FROM MonthlyStats
+        UNION ALL
+        SELECT 'week', date(Day, '-' || ((CAST(strftime('%w', Day) AS INTEGER) + 6) % 7) || ' days'), GuildID,
+               ChannelID, UserID, SUM(TimeSpent)
+        FROM DailyStats
+        GROUP BY 2, GuildID, ChannelID, UserID;
+        INSERT INTO MemberTotals (Kind, Period, GuildID, ChannelID, UserID, TimeSpent)
+        SELECT Kind, Period, GuildID, 0, UserID, SUM(TimeSpent) FROM MemberTotals
+        GROUP BY Kind, Period, GuildID, UserID;
+        CREATE INDEX MemberTotals_Rank ON MemberTotals (Kind, Period, GuildID, ChannelID, TimeSpent DESC, UserID);
+    """),
+    # Whole milliseconds add up exactly however many flushes go into a total, where REAL seconds drift. The tables
+    # are stored in their key's order, without the rowid b-tree a separate key index needed, and copied across in
+    # that order so the pages come out full.
+    (9, "Integer millisecond stats in WITHOUT ROWID tables", """
+        CREATE TABLE AllTimeStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpentMs INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (GuildID, UserID, ChannelID)
+        ) WITHOUT ROWID;
+        INSERT INTO AllTimeStats_new (GuildID, UserID, ChannelID, TimeSpentMs)
+        SELECT GuildID, UserID, ChannelID, CAST(ROUND(TimeSpent * 1000) AS INTEGER) FROM AllTimeStats
+        ORDER BY GuildID, UserID, ChannelID;
+        DROP TABLE AllTimeStats;
+        ALTER TABLE AllTimeStats_new RENAME TO AllTimeStats;
+
+        CREATE TABLE MonthlyStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            TimeSpentMs INTEGER NOT NULL DEFAULT 0,
+            Month TEXT NOT NULL,
+            PRIMARY KEY (GuildID, UserID, ChannelID, Month)
+        ) WITHOUT ROWID;
+        INSERT INTO MonthlyStats_new (GuildID, UserID, ChannelID, TimeSpentMs, Month)
+        SELECT GuildID, UserID, ChannelID, CAST(ROUND(TimeSpent * 1000) AS INTEGER), Month FROM MonthlyStats
+        ORDER BY GuildID, UserID, ChannelID, Month;
+        DROP TABLE MonthlyStats;
+        ALTER TABLE MonthlyStats_new RENAME TO MonthlyStats;
+        CREATE INDEX MonthlyStats_Month ON MonthlyStats (Month, GuildID, UserID, TimeSpentMs);
+
+        CREATE TABLE DailyStats_new (
+            GuildID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            Day TEXT NOT NULL,
+            TimeSpentMs INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (GuildID, UserID, ChannelID, Day)
+        ) WITHOUT ROWID;
+        INSERT INTO DailyStats_new (GuildID, UserID, ChannelID, Day, TimeSpentMs)
+        SELECT GuildID, UserID, ChannelID, Day, CAST(ROUND(TimeSpent * 1000) AS INTEGER) FROM DailyStats
+        ORDER BY GuildID, UserID, ChannelID, Day;
+        DROP TABLE DailyStats;
+        ALTER TABLE DailyStats_new RENAME TO DailyStats;
+        CREATE INDEX DailyStats_Day ON DailyStats (Day, GuildID, UserID, TimeSpentMs);
+
+        CREATE TABLE MemberTotals_new (
+            Kind TEXT NOT NULL,
+            Period TEXT NOT NULL,
+            GuildID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            UserID INTEGER NOT NULL,
+            TimeSpentMs INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (Kind, Period, GuildID, ChannelID, UserID)
+        ) WITHOUT ROWID;
+        INSERT INTO MemberTotals_new (Kind, Period, GuildID, ChannelID, UserID, TimeSpentMs)
+        SELECT Kind, Period, GuildID, ChannelID, UserID, CAST(ROUND(TimeSpent * 1000) AS INTEGER) FROM MemberTotals
+        ORDER BY Kind, Period, GuildID, ChannelID, UserID;
+        DROP TABLE MemberTotals;
+        ALTER TABLE MemberTotals_new RENAME TO MemberTotals;
+        CREATE INDEX MemberTotals_Rank ON MemberTotals (Kind, Period, GuildID, ChannelID, TimeSpentMs DESC, UserID);
+
+        CREATE TABLE ChannelOccupancy_new (
+            GuildID INTEGER NOT NULL,
+            ChannelID INTEGER NOT NULL,
+            HourOfWeek INTEGER NOT NULL,
+            PersonMs INTEGER NOT NULL DEFAULT 0,
+            PeakUsers INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (GuildID, ChannelID, HourOfWeek)
+        ) WITHOUT ROWID;
+        INSERT INTO ChannelOccupancy_new (GuildID, ChannelID, HourOfWeek, PersonMs, PeakUsers)
+        SELECT GuildID, ChannelID, HourOfWeek, CAST(ROUND(PersonSeconds * 1000) AS INTEGER), PeakUsers
+        FROM ChannelOccupancy
+        ORDER BY GuildID, ChannelID, HourOfWeek;
+        DROP TABLE ChannelOccupancy;
+        ALTER TABLE ChannelOccupancy_new RENAME TO ChannelOccupancy;
+    """),
+    (10, "Reclaim pages freed by the conversion", reclaim_free_pages),
+]
+
+
+async def migrate(db):
+    """
+    Brings the database up to the latest schema version. Returns the version it ended on.
+    """
+    async with db.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+
+    for number, name, script in MIGRATIONS:
+        if number <= version:
+            continue
+
+        print(f"Migrating database to version {number}: {name}")
+        if callable(script):
+            await script(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            version = number
+            continue
+
+        try:
+            await db.executescript(f"BEGIN IMMEDIATE; {script}; PRAGMA user_version = {number}; COMMIT;")
+        except Exception:
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            raise
+        version = number
+
+    return version
@@ -0,0 +1,51 @@
+import math
+from typing import NamedTuple
+
+HOURS_PER_WEEK = 168
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+SHADES = " ░▒▓█"
+
+
+class OccupancyCell(NamedTuple):
+    seconds: float  # Person-seconds spent in the hour, over all weeks
+    peak: int  # Most members seen in the channel at once during the hour
+
+
+def hour_of_week(timestamp):
+    """
+    Returns the UTC hour of the week a unix timestamp falls in, 0 being Monday 00:00.
+    """
+    # The epoch was a Thursday, 72 hours after the start of its week
+    return (int(timestamp // 3600) + 72) % HOURS_PER_WEEK
+
+
+def split_by_hour(started_at, ended_at):
+    """
+    Splits a session into (hour of week, seconds) pieces at each hour boundary it crosses.
+    """
+    while started_at < ended_at:
+        piece_end = min(ended_at, (started_at // 3600 + 1) * 3600)
+        yield hour_of_week(started_at), piece_end - started_at
+        started_at = piece_end
+
+
+def heatmap_grid(cells):
+    """
+    Draws 168 OccupancyCell as a day by hour grid, each shaded relative to the busiest hour.
+    """
+    busiest = max(cell.seconds for cell in cells) or 1
+    lines = ["    " + "".join(f"{hour:<3d}" for hour in range(0, 24, 3)).rstrip()]
+    for day, name in enumerate(DAYS):
+        row = cells[day * 24:(day + 1) * 24]
+        lines.append(f"{name} " + "".join(SHADES[math.ceil(cell.seconds / busiest * (len(SHADES) - 1))]
+                                          for cell in row))
+    return "\n".join(lines)
+
+
+def busiest_hours(cells, count):
+    """
+    Returns the hours of the week with the most time spent, as (label, OccupancyCell), busiest first.
+    """
+    hours = sorted((hour for hour in range(HOURS_PER_WEEK) if cells[hour].seconds),
+                   key=lambda hour: cells[hour].seconds, reverse=True)
+    return [(f"{DAYS[hour // 24]} {hour % 24:02d}:00", cells[hour]) for hour in hours[:count]]
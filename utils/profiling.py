@@ -0,0 +1,130 @@
+import asyncio
+import cProfile
+import io
+import marshal
+import pstats
+import time
+import tracemalloc
+from typing import NamedTuple
+
+from utils.utils import resident_memory
+
+KINDS = ("cpu", "memory")
+FRAMES = 10  # Stack frames tracemalloc keeps per allocation
+
+
+class ProfileResult(NamedTuple):
+    summary: str
+    files: dict  # Filename -> bytes
+
+
+def is_idle(func):
+    # pstats names C methods like "<method 'poll' of 'select.epoll' objects>"
+    return func[0] == "~" and "'select." in func[2]
+
+
+class Profiler:
+    """
+    Runs one time-boxed profile of the running bot at a time: cProfile for where time goes, or a pair of
+    tracemalloc snapshots for where memory grows. Neither is hooked in outside of a run, so it costs nothing idle.
+    """
+
+    def __init__(self, top):
+        self.top = top  # Lines in each table of the report
+        self.kind = None  # Kind of the run in progress
+        self.stopping = asyncio.Event()
+
+    async def run(self, kind, seconds):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown profile kind {kind!r}")
+        if self.kind is not None:
+            raise RuntimeError(f"A {self.kind} profile is already running")
+        self.kind = kind
+        self.stopping.clear()
+        try:
+            if kind == "cpu":
+                return await self.profile_cpu(seconds)
+            return await self.profile_memory(seconds)
+        finally:
+            self.kind = None
+
+    def stop(self):
+        """
+        Ends the run in progress early. Returns False if there is none.
+        """
+        if self.kind is None:
+            return False
+        self.stopping.set()
+        return True
+
+    async def wait(self, seconds):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        return time.perf_counter() - start
+
+    async def profile_cpu(self, seconds):
+        # The profiler follows the thread that enables it, the event loop's, so it sees every callback and task
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            elapsed = await self.wait(seconds)
+        finally:
+            profiler.disable()
+
+        text = io.StringIO()
+        stats = pstats.Stats(profiler, stream=text)
+        text.write(f"CPU profile over {elapsed:.1f} seconds\n\n")
+        text.write("Hottest functions, by time spent in the function itself\n")
+        stats.sort_stats("tottime").print_stats(self.top)
+        # The loop's selector poll is time spent waiting for something to do, not work
+        idle = sum(stats.stats[func][2] for func in stats.fcn_list if is_idle(func))
+        hottest = next((func for func in stats.fcn_list if not is_idle(func)), None)
+        text.write("Slowest calls, by time including everything they called\n")
+        stats.sort_stats("cumulative").print_stats(self.top)
+
+        summary = f"{stats.total_calls} calls in {elapsed:.1f} seconds ({idle:.1f} idle)"
+        if hottest is not None:
+            summary += f", hottest: `{pstats.func_std_string(hottest)}` ({stats.stats[hottest][2]:.3f}s)"
+        # profile.pstats is what Stats.dump_stats writes, it loads back with pstats or snakeviz
+        return ProfileResult(summary, {"profile.txt": text.getvalue().encode(),
+                                       "profile.pstats": marshal.dumps(stats.stats)})
+
+    async def profile_memory(self, seconds):
+        # Left running if it was already on (PYTHONTRACEMALLOC), otherwise only traced for this run
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(FRAMES)
+        try:
+            before = tracemalloc.take_snapshot()
+            elapsed = await self.wait(seconds)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>")]
+        before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+        growth = after.compare_to(before, "lineno")
+        stacks = after.compare_to(before, "traceback")
+
+        rss = resident_memory()
+        lines = [f"Memory over {elapsed:.1f} seconds",
+                 f"Traced: {current / 1024 ** 2:.1f} MB now, {peak / 1024 ** 2:.1f} MB peak"
+                 + (f", resident: {rss:.1f} MB" if rss is not None else ""),
+                 "", "Growth by line"]
+        lines += [str(stat) for stat in growth[:self.top]]
+        lines += ["", "Call stacks of the largest growth"]
+        for stat in stacks[:5]:
+            lines += ["", f"{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks"]
+            lines += stat.traceback.format()
+
+        grown = sum(stat.size_diff for stat in growth)
+        summary = f"{grown / 1024:+.1f} KiB traced over {elapsed:.1f} seconds"
+        if growth and growth[0].size_diff > 0:
+            frame = growth[0].traceback[0]
+            summary += f", most from `{frame.filename}:{frame.lineno}` ({growth[0].size_diff / 1024:+.1f} KiB)"
+        return ProfileResult(summary, {"memory.txt": "\n".join(lines).encode()})
@@ -0,0 +1,65 @@
+import datetime as dt
+
+from utils.utils import month_key, recent_months, week_start
+
+MONTHS_KEPT = 3
+DAYS_KEPT = 92  # DailyStats only backs the weekly views, this leaves room for longer ranges
+
+
+async def last_period(db, kind):
+    async with db.execute("SELECT MAX(Period) FROM Rollovers WHERE Kind = ?", (kind,)) as cursor:
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def record_periods(db, kind, periods, now):
+    await db.executemany("INSERT INTO Rollovers (Kind, Period, CompletedAt) VALUES (?, ?, ?)",
+                         [(kind, period, now.isoformat()) for period in periods])
+
+
+async def roll_month(db, now):
+    """
+    Drops every MonthlyStats partition older than the kept window, for all months started since the last run.
+    """
+    current = month_key(now)
+    last = await last_period(db, "month")
+    if last is not None and last >= current:
+        return []
+
+    periods = []
+    year, month = now.year, now.month
+    while last is None or f"{year}-{month:02d}" > last:
+        periods.insert(0, f"{year}-{month:02d}")
+        if last is None:
+            break
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+
+    # Month keys sort in date order and lead MonthlyStats_Month, so however many months were missed this is one
+    # range delete on the index
+    oldest = recent_months(now, MONTHS_KEPT)[-1]
+    await db.execute("DELETE FROM MonthlyStats WHERE Month < ?", (oldest,))
+    await db.execute("DELETE FROM MemberTotals WHERE Kind = 'month' AND Period < ?", (oldest,))
+    await record_periods(db, "month", periods, now)
+    return periods
+
+
+async def prune_days(db, now):
+    cutoff = now.date() - dt.timedelta(days=DAYS_KEPT)
+    cursor = await db.execute("DELETE FROM DailyStats WHERE Day < ?", (cutoff.isoformat(),))
+    # Weekly totals go once the whole week has
+    await db.execute("DELETE FROM MemberTotals WHERE Kind = 'week' AND Period < ?", (week_start(cutoff).isoformat(),))
+    return cursor.rowcount
+
+
+async def run_rollovers(database, now):
+    """
+    Runs every rollover that is due as of now in a single transaction, then hands the pages the deleted rows
+    used back to the filesystem. Safe to call repeatedly, periods already in the ledger are skipped.
+    """
+    async with database.transaction() as db:
+        periods = await roll_month(db, now)
+        pruned = await prune_days(db, now)
+
+    if periods or pruned:
+        await database.incremental_vacuum()
+    return periods
@@ -0,0 +1,127 @@
+import time
+
+
+class Session:
+    """
+    One member's time in one voice channel. Times are unix seconds on SessionTracker's clock.
+    """
+    __slots__ = ("guild_id", "user_id", "channel_id", "started_at", "left_at")
+
+    def __init__(self, guild_id, user_id, channel_id, started_at):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.started_at = started_at
+        self.left_at = None  # Set while the session is held after a leave
+
+    @property
+    def key(self):
+        return self.guild_id, self.user_id
+
+
+class SessionTracker:
+    """
+    Every voice session in progress, indexed by member and by channel, plus sessions held for a short while after a
+    leave in case the member rejoins. Memory is proportional to who is in voice right now: a channel's entry goes
+    as soon as its last member leaves.
+
+    Time comes from the monotonic clock, anchored to the wall clock once at startup, so a session's length is not
+    thrown off when NTP steps the system clock.
+    """
+
+    def __init__(self):
+        self.open = {}  # (GuildID, UserID) -> Session
+        self.held = {}  # (GuildID, UserID) -> Session left but not written yet
+        self.channels = {}  # ChannelID -> {UserID: Session}, only channels with a session open
+        self.offset = time.time() - time.monotonic()
+
+    def clock(self):
+        """
+        Returns the current time in unix seconds, moving forward at a steady rate.
+        """
+        return self.offset + time.monotonic()
+
+    def __len__(self):
+        return len(self.open)
+
+    def __contains__(self, key):
+        return key in self.open
+
+    def __iter__(self):
+        return iter(list(self.open.values()))
+
+    def get(self, guild_id, user_id):
+        return self.open.get((guild_id, user_id))
+
+    def start(self, guild_id, user_id, channel_id, started_at=None):
+        """
+        Opens a session, from now unless a start is given. Replaces any open session of the member.
+        """
+        self.stop(guild_id, user_id)
+        session = Session(guild_id, user_id, channel_id, self.clock() if started_at is None else started_at)
+        self.add(session)
+        return session
+
+    def add(self, session):
+        session.left_at = None
+        self.open[session.key] = session
+        self.channels.setdefault(session.channel_id, {})[session.user_id] = session
+
+    def stop(self, guild_id, user_id):
+        """
+        Closes a member's open session and returns it, or None if they had none.
+        """
+        session = self.open.pop((guild_id, user_id), None)
+        if session is not None:
+            members = self.channels[session.channel_id]
+            del members[user_id]
+            if not members:
+                del self.channels[session.channel_id]
+        return session
+
+    def hold(self, session, left_at):
+        """
+        Keeps a closed session aside, ending at left_at, until it is resumed or released.
+        """
+        session.left_at = left_at
+        self.held[session.key] = session
+
+    def resume(self, guild_id, user_id):
+        """
+        Reopens a held session as if it had never been left. Returns it, or None if nothing was held.
+        """
+        session = self.held.pop((guild_id, user_id), None)
+        if session is not None:
+            self.add(session)
+        return session
+
+    def release(self, guild_id, user_id):
+        """
+        Drops a held session and returns it, for it to be written.
+        """
+        return self.held.pop((guild_id, user_id), None)
+
+    def members(self, channel_id):
+        """
+        Returns the IDs of the members with a session open in a channel.
+        """
+        return self.channels.get(channel_id, {}).keys()
+
+    def headcount(self, channel_id):
+        return len(self.channels.get(channel_id, ()))
+
+    def spans(self, guild_id, user_id=None):
+        """
+        Yields (user ID, channel ID, started at, ended at) for the open and held sessions in a guild, or of one
+        member. Open sessions end now.
+        """
+        if user_id is not None:
+            sessions = (self.open.get((guild_id, user_id)), self.held.get((guild_id, user_id)))
+        else:
+            sessions = [session for group in (self.open, self.held) for session in group.values()
+                        if session.guild_id == guild_id]
+        now = self.clock()
+        for session in sessions:
+            if session is not None:
+                ended_at = now if session.left_at is None else session.left_at
+                yield session.user_id, session.channel_id, session.started_at, ended_at
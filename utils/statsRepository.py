@@ -0,0 +1,320 @@
+import json
+from typing import NamedTuple
+
+from utils.occupancy import HOURS_PER_WEEK, OccupancyCell
+from utils.utils import to_ms, from_ms
+
+# Statement text is kept constant (lists are bound as one JSON array) so every query hits the connection's
+# prepared statement cache. Time is stored as integer milliseconds, sums stay exact and are turned into seconds last.
+MEMBER_ALLTIME = ("SELECT ChannelID, TimeSpentMs / 1000.0 FROM AllTimeStats WHERE GuildID = ? AND UserID = ? "
+                  "ORDER BY ChannelID")
+MEMBER_WEEK = ("SELECT ChannelID, SUM(TimeSpentMs) / 1000.0 FROM DailyStats WHERE GuildID = ? AND UserID = ? "
+               "AND Day >= ? GROUP BY ChannelID ORDER BY ChannelID")
+MEMBER_MONTHS = ("SELECT Month, ChannelID, TimeSpentMs / 1000.0 FROM MonthlyStats WHERE GuildID = ? AND UserID = ? "
+                 "AND Month IN (SELECT value FROM json_each(?)) ORDER BY Month, ChannelID")
+MEMBER_WEEKS = ("SELECT Period, TimeSpentMs / 1000.0 FROM MemberTotals WHERE Kind = 'week' "
+                "AND Period IN (SELECT value FROM json_each(?)) AND GuildID = ? AND ChannelID = 0 AND UserID = ?")
+
+ALL_CHANNELS = 0  # MemberTotals ChannelID of a member's time across every channel
+
+# Per-member totals for one leaderboard (window, period and channel) in one guild, restricted to a set of members
+# and leaving out those with unwritten time, who are merged in separately. This is the inner query leaderboards page
+# over, MemberTotals_Rank hands its rows over already in page order. Totals stay in milliseconds here so the keyset
+# queries below order by the indexed column itself.
+BOARD = "Kind = ? AND Period = ? AND GuildID = ? AND ChannelID = ?"
+TOTALS = (f"SELECT UserID, TimeSpentMs AS Total FROM MemberTotals WHERE {BOARD} "
+          f"AND UserID IN (SELECT value FROM json_each(?)) AND UserID NOT IN (SELECT value FROM json_each(?))")
+STORED_TOTALS = (f"SELECT UserID, TimeSpentMs FROM MemberTotals WHERE {BOARD} "
+                 f"AND UserID IN (SELECT value FROM json_each(?))")
+
+# A place on a whole guild's leaderboard: counts of the stored members ahead of a total and of everyone, both range
+# scans, leaving out the members with unwritten time
+RANK = f"""
+    SELECT (SELECT COUNT(*) FROM MemberTotals
+            WHERE {BOARD} AND TimeSpentMs > ? AND UserID NOT IN (SELECT value FROM json_each(?))),
+           (SELECT COUNT(*) FROM MemberTotals WHERE {BOARD} AND UserID NOT IN (SELECT value FROM json_each(?)))
+"""
+
+# Keyset queries over a totals query, ordered by Total DESC, UserID
+FIRST = "SELECT UserID, Total FROM ({query}) WHERE Total >= ? ORDER BY Total DESC, UserID LIMIT ?"
+AFTER = ("SELECT UserID, Total FROM ({query}) WHERE Total >= ? AND (Total < ? OR (Total = ? AND UserID > ?)) "
+         "ORDER BY Total DESC, UserID LIMIT ?")
+LAST = "SELECT UserID, Total FROM ({query}) WHERE Total >= ? ORDER BY Total ASC, UserID DESC LIMIT ?"
+BEFORE = ("SELECT UserID, Total FROM ({query}) WHERE Total >= ? AND (Total > ? OR (Total = ? AND UserID < ?)) "
+          "ORDER BY Total ASC, UserID DESC LIMIT ?")
+OFFSET = "SELECT UserID, Total FROM ({query}) WHERE Total >= ? ORDER BY Total DESC, UserID LIMIT ? OFFSET ?"
+COUNT = "SELECT COUNT(*) FROM ({query}) WHERE Total >= ?"
+
+# Hour-of-week buckets for a set of channels, at most 168 rows per channel read straight off the primary key
+OCCUPANCY = ("SELECT HourOfWeek, SUM(PersonMs) / 1000.0, MAX(PeakUsers) FROM ChannelOccupancy WHERE GuildID = ? "
+             "AND ChannelID IN (SELECT value FROM json_each(?)) GROUP BY HourOfWeek")
+
+DELETE_MEMBER = {
+    "month": ("DELETE FROM MonthlyStats WHERE GuildID = ? AND UserID = ?",
+              "DELETE FROM MemberTotals WHERE Kind = 'month' AND GuildID = ? AND UserID = ?"),
+    "week": ("DELETE FROM DailyStats WHERE GuildID = ? AND UserID = ? AND Day >= ?",
+             "DELETE FROM MemberTotals WHERE Kind = 'week' AND GuildID = ? AND UserID = ? AND Period >= ?"),
+    "alltime": ("DELETE FROM AllTimeStats WHERE GuildID = ? AND UserID = ?",
+                "DELETE FROM MemberTotals WHERE Kind = 'alltime' AND GuildID = ? AND UserID = ?"),
+}
+
+
+class ChannelTime(NamedTuple):
+    channel_id: int
+    seconds: float
+
+
+class MemberTotal(NamedTuple):
+    user_id: int
+    seconds: float
+
+
+class Rank(NamedTuple):
+    rank: int
+    members: int  # Members on the leaderboard
+    seconds: float
+
+    @property
+    def percentile(self):
+        # Share of the leaderboard this member is ahead of or level with
+        return 100 * (self.members - self.rank + 1) / self.members
+
+
+class Totals(NamedTuple):
+    """
+    Per-member totals for one window, as a query and its parameters, plus the totals of members with unwritten time
+    which the query leaves out.
+    """
+    query: str
+    params: tuple
+    live: tuple = ()  # MemberTotal
+
+
+def page_key(row):
+    return -row.seconds, row.user_id
+
+
+def merge_channels(rows, unwritten):
+    channels = dict(rows)
+    for channel_id, seconds in unwritten.items():
+        channels[channel_id] = channels.get(channel_id, 0) + seconds
+    return [ChannelTime(channel_id, seconds) for channel_id, seconds in sorted(channels.items())]
+
+
+def id_list(ids):
+    return json.dumps(list(ids))
+
+
+class StatsRepository:
+    """
+    Read access to the voice stats for every cog, on pooled read connections.
+
+    While a LiveTime is attached as live, time not written yet (open sessions and the write buffer) is added to
+    every member's stats, leaderboard and rank.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.live = None
+
+    def unwritten(self, kind, period, guild_id, user_id):
+        return self.live.member(kind, period, guild_id, user_id) if self.live is not None else {}
+
+    def unwritten_board(self, kind, period, guild_id, channel_id):
+        return self.live.board(kind, period, guild_id, channel_id) if self.live is not None else {}
+
+    async def fetchall(self, sql, params=()):
+        async with self.db.read() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    async def fetchone(self, sql, params=()):
+        async with self.db.read() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def consistent(self, read):
+        """
+        Returns await read(), a read of unwritten and stored time together, run again until no voice buffer flush
+        committed during it, so no time is counted both as unwritten and as stored, or as neither.
+        """
+        if self.live is None:
+            return await read()
+        while True:
+            generation = await self.live.settled()
+            result = await read()
+            if self.live.generation == generation:
+                return result
+
+    # One member, any window
+
+    async def member_alltime(self, guild_id, user_id):
+        async def read():
+            unwritten = self.unwritten("alltime", "", guild_id, user_id)
+            return await self.fetchall(MEMBER_ALLTIME, (guild_id, user_id)), unwritten
+
+        return merge_channels(*await self.consistent(read))
+
+    async def member_week(self, guild_id, user_id, since):
+        async def read():
+            unwritten = self.unwritten("week", since.isoformat(), guild_id, user_id)
+            return await self.fetchall(MEMBER_WEEK, (guild_id, user_id, since.isoformat())), unwritten
+
+        return merge_channels(*await self.consistent(read))
+
+    async def member_months(self, guild_id, user_id, months):
+        """
+        Returns {month: [ChannelTime, ...]} for each of the given months, in one query.
+        """
+        async def read():
+            unwritten = {month: self.unwritten("month", month, guild_id, user_id) for month in months}
+            return await self.fetchall(MEMBER_MONTHS, (guild_id, user_id, id_list(months))), unwritten
+
+        stored, unwritten = await self.consistent(read)
+        result = {month: [] for month in months}
+        for month, channel_id, seconds in stored:
+            result[month].append(ChannelTime(channel_id, seconds))
+        return {month: merge_channels(rows, unwritten[month]) for month, rows in result.items()}
+
+    async def member_weeks(self, guild_id, user_id, weeks):
+        """
+        Returns {week: seconds} for each of the given weeks (their Mondays), across all channels.
+        """
+        periods = [week.isoformat() for week in weeks]
+
+        async def read():
+            unwritten = {period: sum(self.unwritten("week", period, guild_id, user_id).values()) for period in periods}
+            return dict(await self.fetchall(MEMBER_WEEKS, (id_list(periods), guild_id, user_id))), unwritten
+
+        stored, unwritten = await self.consistent(read)
+        return {week: stored.get(period, 0) + unwritten[period] for week, period in zip(weeks, periods)}
+
+    # Many members, one window
+
+    async def board_totals(self, board, member_ids):
+        """
+        Returns the Totals of the given members on a leaderboard. Members with unwritten time get their full total
+        worked out now, the rest are left to the query.
+        """
+        members = set(member_ids)
+
+        async def read():
+            unwritten = {user_id: seconds for user_id, seconds in self.unwritten_board(*board).items()
+                         if user_id in members}
+            if not unwritten:
+                return unwritten, {}
+            return unwritten, dict(await self.fetchall(STORED_TOTALS, (*board, id_list(unwritten))))
+
+        unwritten, stored = await self.consistent(read)
+        live = ()
+        if unwritten:
+            # Whole milliseconds like the stored totals, so every total converts back exactly for the keyset bounds
+            live = tuple(MemberTotal(user_id, from_ms(stored.get(user_id, 0) + to_ms(seconds)))
+                         for user_id, seconds in unwritten.items())
+        return Totals(TOTALS, (*board, id_list(members), id_list(unwritten)), live)
+
+    async def alltime_totals(self, guild_id, member_ids, channel_id=ALL_CHANNELS):
+        return await self.board_totals(("alltime", "", guild_id, channel_id), member_ids)
+
+    async def week_totals(self, guild_id, member_ids, since, channel_id=ALL_CHANNELS):
+        # since is the Monday the week starts on
+        return await self.board_totals(("week", since.isoformat(), guild_id, channel_id), member_ids)
+
+    async def month_totals(self, guild_id, member_ids, month, channel_id=ALL_CHANNELS):
+        return await self.board_totals(("month", month, guild_id, channel_id), member_ids)
+
+    async def count_totals(self, totals, minimum=0):
+        stored = (await self.fetchone(COUNT.format(query=totals.query), (*totals.params, to_ms(minimum))))[0]
+        return stored + sum(1 for row in totals.live if row.seconds >= minimum)
+
+    async def totals_page(self, totals, limit, minimum=0, after=None, before=None, last=False, offset=None):
+        """
+        Returns a page of MemberTotal ordered by total time, highest first. Pages are found by seeking past the
+        (total, user ID) key of a neighbouring page's edge row, from the last row backwards, or by offset.
+        """
+        query, params = totals.query, (*totals.params, to_ms(minimum))
+        if after is not None:
+            sql, args, reverse = AFTER, (to_ms(after[0]), to_ms(after[0]), after[1], limit), False
+        elif before is not None:
+            sql, args, reverse = BEFORE, (to_ms(before[0]), to_ms(before[0]), before[1], limit), True
+        elif last:
+            sql, args, reverse = LAST, (limit,), True
+        elif offset and totals.live:
+            # Live rows can land anywhere before the offset, so it is applied after the merge below
+            sql, args, reverse = FIRST, (offset + limit,), False
+        elif offset:
+            sql, args, reverse = OFFSET, (limit, offset), False
+        else:
+            sql, args, reverse = FIRST, (limit,), False
+
+        rows = [MemberTotal(user_id, from_ms(total))
+                for user_id, total in await self.fetchall(sql.format(query=query), (*params, *args))]
+        if not totals.live:
+            return rows[::-1] if reverse else rows
+
+        # The few members with unwritten time are merged in here, filtered by the same page bounds
+        live = [row for row in totals.live if row.seconds >= minimum]
+        if after is not None:
+            live = [row for row in live if page_key(row) > (-after[0], after[1])]
+        elif before is not None:
+            live = [row for row in live if page_key(row) < (-before[0], before[1])]
+        merged = sorted(rows + live, key=page_key)
+        if sql is FIRST and offset:
+            return merged[offset:offset + limit]
+        return merged[-limit:] if reverse else merged[:limit]
+
+    # Channels
+
+    async def occupancy(self, guild_id, channel_ids):
+        """
+        Returns the 168 hour-of-week OccupancyCell for the given channels combined: time spent is summed, the peak
+        is the highest of any one channel.
+        """
+        cells = [OccupancyCell(0, 0)] * HOURS_PER_WEEK
+        for hour, seconds, peak in await self.fetchall(OCCUPANCY, (guild_id, id_list(channel_ids))):
+            cells[hour] = OccupancyCell(seconds, peak)
+        return cells
+
+    async def rank(self, kind, period, guild_id, user_id, channel_id=ALL_CHANNELS):
+        """
+        Returns a member's Rank on a guild's leaderboard for one window, e.g. ("month", "2024-05"), or None when
+        they have no time on it.
+        """
+        board = (kind, period, guild_id, channel_id)
+
+        async def read():
+            unwritten = self.unwritten_board(*board)
+            return unwritten, dict(await self.fetchall(STORED_TOTALS, (*board, id_list({*unwritten, user_id}))))
+
+        # RANK leaves the members with unwritten time out, so only this read has to agree with the snapshot
+        unwritten, stored = await self.consistent(read)
+        live = {member_id: stored.get(member_id, 0) + to_ms(seconds) for member_id, seconds in unwritten.items()}
+        if user_id not in live and user_id not in stored:
+            return None
+
+        ms = live.get(user_id, stored.get(user_id))
+        live_ids = id_list(live)
+        ahead, members = await self.fetchone(RANK, (*board, ms, live_ids, *board, live_ids))
+        ahead += sum(1 for total in live.values() if total > ms)
+        return Rank(ahead + 1, members + len(live), from_ms(ms))
+
+    # Voice listener state
+
+    async def open_sessions(self):
+        """
+        Returns the checkpointed open sessions as {(GuildID, UserID): (ChannelID, StartedAt)}.
+        """
+        rows = await self.fetchall("SELECT GuildID, UserID, ChannelID, StartedAt FROM OpenSessions")
+        return {(guild_id, user_id): (channel_id, started_at) for guild_id, user_id, channel_id, started_at in rows}
+
+    async def heartbeat(self):
+        row = await self.fetchone("SELECT Value FROM BotState WHERE Key = 'heartbeat'")
+        return row[0] if row else None
+
+    # Maintenance
+
+    async def delete_member(self, window, guild_id, user_id, since=None):
+        params = (guild_id, user_id, since.isoformat()) if window == "week" else (guild_id, user_id)
+        async with self.db.transaction() as db:
+            for statement in DELETE_MEMBER[window]:
+                await db.execute(statement, params)
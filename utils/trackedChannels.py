@@ -0,0 +1,49 @@
+class TrackedChannels:
+    """
+    The voice channels tracked in each guild, loaded once from the TrackedChannels table and kept in sets so the
+    voice listener's membership checks are O(1). Changes are written through to the database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.by_guild = {}  # GuildID -> set of ChannelIDs
+        self.channels = set()  # Every tracked ChannelID, channel IDs are unique across guilds
+
+    def __contains__(self, channel_id):
+        return channel_id in self.channels
+
+    def for_guild(self, guild_id):
+        return self.by_guild.get(guild_id, set())
+
+    async def load(self):
+        by_guild = {}
+        async with self.db.read() as db:
+            async with db.execute("SELECT GuildID, ChannelID FROM TrackedChannels") as cursor:
+                async for guild_id, channel_id in cursor:
+                    by_guild.setdefault(guild_id, set()).add(channel_id)
+        self.by_guild = by_guild
+        self.channels = set().union(*by_guild.values())
+
+    async def add(self, guild_id, channel_id):
+        """
+        Starts tracking a channel. Returns False if it already was.
+        """
+        if channel_id in self.channels:
+            return False
+        async with self.db.transaction() as db:
+            await db.execute("INSERT INTO TrackedChannels (GuildID, ChannelID) VALUES (?, ?)", (guild_id, channel_id))
+        self.by_guild.setdefault(guild_id, set()).add(channel_id)
+        self.channels.add(channel_id)
+        return True
+
+    async def remove(self, guild_id, channel_id):
+        """
+        Stops tracking a channel. Returns False if it was not tracked in that guild.
+        """
+        if channel_id not in self.for_guild(guild_id):
+            return False
+        async with self.db.transaction() as db:
+            await db.execute("DELETE FROM TrackedChannels WHERE GuildID = ? AND ChannelID = ?", (guild_id, channel_id))
+        self.by_guild[guild_id].discard(channel_id)
+        self.channels.discard(channel_id)
+        return True
@@ -1,5 +1,83 @@
 import datetime as dt
+import os
 
 
 def utc_now():
     return dt.datetime.now(dt.timezone.utc)
+
+
+def week_start(day):
+    """
+    Returns the Monday of the week the given date falls in.
+    """
+    return day - dt.timedelta(days=day.weekday())
+
+
+def recent_weeks(day, count):
+    """
+    Returns the Mondays of the count weeks up to and including the one the given date falls in, newest first.
+    """
+    monday = week_start(day)
+    return [monday - dt.timedelta(weeks=weeks) for weeks in range(count)]
+
+
+def month_key(day):
+    """
+    Returns the 'YYYY-MM' key MonthlyStats is partitioned by. Keys sort in date order.
+    """
+    return f"{day.year}-{day.month:02d}"
+
+
+def recent_months(day, count):
+    """
+    Returns the keys of the count months up to and including the one the given date falls in, newest first.
+    """
+    keys = []
+    year, month = day.year, day.month
+    for _ in range(count):
+        keys.append(f"{year}-{month:02d}")
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return keys
+
+
+def month_name(key):
+    return dt.datetime.strptime(key, "%Y-%m").strftime("%B %Y")
+
+
+def to_ms(seconds):
+    """
+    Converts seconds to the whole milliseconds voice time is stored in.
+    """
+    return round(seconds * 1000)
+
+
+def from_ms(ms):
+    return ms / 1000
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as days, hours, minutes and seconds, leaving out leading units that are zero.
+    """
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days >= 1:
+        return f"{int(days)} days, {int(hours)} hours, {int(minutes)} minutes, {round(seconds, 2)} seconds"
+    if hours >= 1:
+        return f"{int(hours)} hours, {int(minutes)} minutes, {round(seconds, 2)} seconds"
+    if minutes >= 1:
+        return f"{int(minutes)} minutes, {round(seconds, 2)} seconds"
+    return f"{round(seconds, 2)} seconds"
+
+
+def resident_memory():
+    """
+    Returns the process' resident memory in MB, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
@@ -0,0 +1,199 @@
+import asyncio
+import datetime as dt
+import time
+from itertools import chain
+
+from utils import metrics
+from utils.occupancy import hour_of_week, split_by_hour
+from utils.statsRepository import ALL_CHANNELS
+from utils.utils import month_key, to_ms, week_start
+
+INSERT_SESSION = ("INSERT INTO VoiceSessions (GuildID, UserID, ChannelID, StartedAt, EndedAt) "
+                  "VALUES (?, ?, ?, ?, ?)")
+ADD_DAILY = ("INSERT INTO DailyStats (GuildID, UserID, ChannelID, Day, TimeSpentMs) VALUES (?, ?, ?, ?, ?) "
+             "ON CONFLICT (GuildID, UserID, ChannelID, Day) "
+             "DO UPDATE SET TimeSpentMs = TimeSpentMs + excluded.TimeSpentMs")
+ADD_MONTHLY = ("INSERT INTO MonthlyStats (GuildID, UserID, ChannelID, TimeSpentMs, Month) VALUES (?, ?, ?, ?, ?) "
+               "ON CONFLICT (GuildID, UserID, ChannelID, Month) "
+               "DO UPDATE SET TimeSpentMs = TimeSpentMs + excluded.TimeSpentMs")
+ADD_ALLTIME = ("INSERT INTO AllTimeStats (GuildID, UserID, ChannelID, TimeSpentMs) VALUES (?, ?, ?, ?) "
+               "ON CONFLICT (GuildID, UserID, ChannelID) "
+               "DO UPDATE SET TimeSpentMs = TimeSpentMs + excluded.TimeSpentMs")
+ADD_OCCUPANCY = ("INSERT INTO ChannelOccupancy (GuildID, ChannelID, HourOfWeek, PersonMs, PeakUsers) "
+                 "VALUES (?, ?, ?, ?, ?) ON CONFLICT (GuildID, ChannelID, HourOfWeek) "
+                 "DO UPDATE SET PersonMs = PersonMs + excluded.PersonMs, "
+                 "PeakUsers = MAX(PeakUsers, excluded.PeakUsers)")
+ADD_TOTAL = ("INSERT INTO MemberTotals (Kind, Period, GuildID, ChannelID, UserID, TimeSpentMs) "
+             "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (Kind, Period, GuildID, ChannelID, UserID) "
+             "DO UPDATE SET TimeSpentMs = TimeSpentMs + excluded.TimeSpentMs")
+SAVE_CHECKPOINT = ("INSERT OR REPLACE INTO OpenSessions (GuildID, UserID, ChannelID, StartedAt) "
+                   "VALUES (?, ?, ?, ?)")
+DELETE_CHECKPOINT = "DELETE FROM OpenSessions WHERE GuildID = ? AND UserID = ?"
+SAVE_HEARTBEAT = ("INSERT INTO BotState (Key, Value) VALUES ('heartbeat', ?) "
+                  "ON CONFLICT (Key) DO UPDATE SET Value = excluded.Value")
+
+
+def split_by_day(started_at, ended_at):
+    """
+    Splits a session into (day, seconds) pieces at each UTC midnight it crosses.
+    """
+    while started_at < ended_at:
+        day = dt.datetime.fromtimestamp(started_at, dt.timezone.utc).date()
+        midnight = dt.datetime.combine(day + dt.timedelta(days=1), dt.time(), dt.timezone.utc).timestamp()
+        piece_end = min(ended_at, midnight)
+        yield day, piece_end - started_at
+        started_at = piece_end
+
+
+def add_to(totals, key, seconds):
+    totals[key] = totals.get(key, 0) + seconds
+
+
+class VoiceBuffer:
+    """
+    Collects finished voice sessions in memory and writes them out in one transaction per flush: each session is
+    appended to VoiceSessions and its time added to the DailyStats, MonthlyStats and AllTimeStats rollups, to the
+    leaderboards' MemberTotals and to its channel's hour-of-week ChannelOccupancy buckets, along with the peak
+    headcounts seen since the last flush.
+
+    Every flush also saves the OpenSessions checkpoint and a heartbeat, so sessions still in progress can be
+    recovered after a restart.
+    """
+
+    def __init__(self, db, threshold):
+        self.db = db
+        self.threshold = threshold
+        self.pending = []
+        self.writing = []  # The batch of the flush in progress, until it commits
+        self.flushing = asyncio.Lock()  # Held by the flush in progress
+        self.generation = 0  # Bumped when a flush starts writing and again once it is done, odd in between
+        self.checkpoints = {}  # (GuildID, UserID) -> (ChannelID, StartedAt) of a newly opened session, or None
+        self.peaks = {}  # (GuildID, ChannelID, HourOfWeek) -> most members seen in the channel at once
+
+        # Flush statistics
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    @property
+    def avg_latency(self):
+        return self.total_latency / self.flushes if self.flushes else 0.0
+
+    def add(self, guild_id, user_id, channel_id, started_at, ended_at):
+        """
+        Adds a finished session, timestamps in unix seconds. Returns True once the buffer has reached its size
+        threshold.
+        """
+        self.pending.append((guild_id, user_id, channel_id, started_at, ended_at))
+        self.checkpoints[guild_id, user_id] = None
+        return len(self.pending) >= self.threshold
+
+    def open(self, guild_id, user_id, channel_id, started_at):
+        """
+        Checkpoints a session that has just started.
+        """
+        self.checkpoints[guild_id, user_id] = (channel_id, started_at)
+
+    def unwritten(self):
+        """
+        Returns every session added but not committed yet.
+        """
+        return chain(self.writing, self.pending)
+
+    def headcount(self, guild_id, channel_id, users, at):
+        """
+        Records how many members were in a channel at the given unix time.
+        """
+        key = (guild_id, channel_id, hour_of_week(at))
+        if users > self.peaks.get(key, 0):
+            self.peaks[key] = users
+
+    def forget(self, guild_id, user_id):
+        """
+        Drops a checkpointed session without recording it.
+        """
+        self.checkpoints[guild_id, user_id] = None
+
+    async def flush(self):
+        """
+        Writes everything buffered so far. Returns the number of sessions written.
+        """
+        # A flush started while another is writing waits for it to commit, so the batch in progress stays visible to
+        # unwritten() and a failed one is put back before the next batch is taken
+        async with self.flushing:
+            self.generation += 1
+            try:
+                return await self.write()
+            finally:
+                self.generation += 1
+
+    async def write(self):
+        # Swap the buffer out first so sessions closing mid-flush land in the next batch
+        batch, self.pending = self.pending, []
+        self.writing = batch
+        checkpoints, self.checkpoints = self.checkpoints, {}
+        peaks, self.peaks = self.peaks, {}
+        daily, monthly, alltime, totals = {}, {}, {}, {}
+        occupancy = {key: [0, users] for key, users in peaks.items()}
+        periods = {}  # Date -> its day, month and week keys, a batch only spans a few days
+        # Each piece is rounded to milliseconds once, so every rollup adds up the same integers and they agree exactly
+        for guild_id, user_id, channel_id, started_at, ended_at in batch:
+            for day, seconds in split_by_day(started_at, ended_at):
+                keys = periods.get(day)
+                if keys is None:
+                    keys = periods[day] = (day.isoformat(), month_key(day), week_start(day).isoformat())
+                day_key, month, week = keys
+                ms = to_ms(seconds)
+                add_to(daily, (guild_id, user_id, channel_id, day_key), ms)
+                add_to(monthly, (guild_id, user_id, channel_id, month), ms)
+                add_to(alltime, (guild_id, user_id, channel_id), ms)
+                for kind, period in (("alltime", ""), ("month", month), ("week", week)):
+                    add_to(totals, (kind, period, guild_id, channel_id, user_id), ms)
+                    add_to(totals, (kind, period, guild_id, ALL_CHANNELS, user_id), ms)
+            for hour, seconds in split_by_hour(started_at, ended_at):
+                occupancy.setdefault((guild_id, channel_id, hour), [0, 0])[0] += to_ms(seconds)
+
+        start = time.perf_counter()
+        try:
+            async with self.db.transaction() as db:
+                await db.executemany(INSERT_SESSION, batch)
+                await db.executemany(ADD_DAILY, [(*key, ms) for key, ms in daily.items()])
+                await db.executemany(ADD_MONTHLY, [(guild_id, user_id, channel_id, ms, month)
+                                                   for (guild_id, user_id, channel_id, month), ms in monthly.items()])
+                await db.executemany(ADD_ALLTIME, [(*key, ms) for key, ms in alltime.items()])
+                await db.executemany(ADD_TOTAL, [(*key, ms) for key, ms in totals.items()])
+                await db.executemany(ADD_OCCUPANCY, [(*key, ms, users) for key, (ms, users) in occupancy.items()])
+                await db.executemany(DELETE_CHECKPOINT, [key for key, session in checkpoints.items()
+                                                         if session is None])
+                await db.executemany(SAVE_CHECKPOINT, [(*key, *session) for key, session in checkpoints.items()
+                                                       if session is not None])
+                await db.execute(SAVE_HEARTBEAT, (time.time(),))
+        except Exception:
+            # Put the batch back so nothing is lost, the next flush retries it. Checkpoint changes made since the
+            # swap are newer, so they win.
+            self.pending[:0] = batch
+            self.checkpoints = {**checkpoints, **self.checkpoints}
+            for key, users in peaks.items():
+                if users > self.peaks.get(key, 0):
+                    self.peaks[key] = users
+            raise
+        finally:
+            self.writing = []
+
+        latency = time.perf_counter() - start
+        rows = len(batch) + len(daily) + len(monthly) + len(alltime) + len(totals) + len(occupancy)
+        self.flushes += 1
+        self.rows_written += rows
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+        metrics.FLUSH_SECONDS.observe(latency)
+        metrics.SESSIONS_WRITTEN.inc(len(batch))
+        metrics.ROWS_WRITTEN.inc(rows)
+        return len(batch)